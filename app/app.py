@@ -1,9 +1,10 @@
 import datetime
+import logging
 import os
 
 import pytz as pytz
 import requests
-from flask import Flask, render_template, session, flash
+from flask import Flask, render_template, flash
 from flask_breadcrumbs import Breadcrumbs
 from flask_dance.consumer import oauth_authorized
 from flask_dance.consumer.backend.sqla import SQLAlchemyBackend
@@ -11,29 +12,61 @@ from flask_dance.contrib.facebook import make_facebook_blueprint
 from flask_dance.contrib.github import make_github_blueprint
 from flask_dance.contrib.google import make_google_blueprint
 from flask_login import current_user, login_user
+from jinja2 import FileSystemBytecodeCache
 from sqlalchemy.orm.exc import NoResultFound
 from werkzeug.contrib.fixers import ProxyFix
 
+from app.blueprints.catalog.models import category_cache
 from app.blueprints.catalog.views import catalog
-from app.blueprints.user.models import User, OAuth
+from app.blueprints.user.models import User, OAuth, user_cache
 from app.blueprints.user.views import user_blueprint
-from app.extensions import login_manager, csrf, debug_toolbar, db
+from app.extensions import login_manager, csrf, debug_toolbar, db, fragment_cache, image_pipeline, upload_store, \
+    assets, metrics
+from app.lib.sessions import LazySessionInterface
+from app.lib.storage import StreamingUploadRequest
 
+logger = logging.getLogger(__name__)
 
-def create_app():
+
+# Configuration profiles, loaded on top of config.settings.
+PROFILES = {
+    'development': None,
+    'production': 'config.production'
+}
+
+
+def create_app(settings_override=None, env=None):
     """
     Creates a flask application using the App Factory pattern
+    :param settings_override: Override settings
+    :param env: Configuration profile, 'development' or 'production'. Read
+      from the CATALOG_ENV environment variable by default.
     :return: Flask app
     """
     app = Flask(__name__, instance_relative_config=True)
+    app.request_class = StreamingUploadRequest
     app.config.from_object('config.settings')
+
+    env = env or os.environ.get('CATALOG_ENV', 'development')
+    if env not in PROFILES:
+        raise ValueError(f"Unknown CATALOG_ENV {env!r}, expected one of {', '.join(PROFILES)}")
+    if PROFILES[env]:
+        app.config.from_object(PROFILES[env])
+    app.config['ENV'] = env
+
     app.config.from_pyfile('settings.py', silent=True)
 
     app.config['TESTING'] = False
 
+    if settings_override:
+        app.config.update(settings_override)
+
+    configure_logging(app)
+    templating(app)
     error_templates(app)
     middleware(app)
     extensions(app)
+    instrumentation(app)
     app.register_blueprint(catalog)
     app.register_blueprint(user_blueprint)
     init_oauth_providers(app)
@@ -43,6 +76,52 @@ def create_app():
     return app
 
 
+def configure_logging(app):
+    """
+    Set the level of the application's loggers from LOG_LEVEL (mutates the
+    app passed in).
+
+    :param app: Flask application instance
+    :return: None
+    """
+    package_logger = logging.getLogger('app')
+    package_logger.setLevel(app.config['LOG_LEVEL'])
+    if not package_logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        package_logger.addHandler(handler)
+    app.logger.setLevel(app.config['LOG_LEVEL'])
+    return None
+
+
+def templating(app):
+    """
+    Configure the Jinja environment, which must happen before it is first
+    used (mutates the app passed in).
+
+    Templates are compiled once and their bytecode cached on disk when
+    JINJA_BYTECODE_CACHE is enabled, and only checked for changes when
+    TEMPLATES_AUTO_RELOAD is enabled.
+
+    Jinja loads the cached bytecode as code, so the cache directory must not
+    be writable by other users: it is created with mode 0700, and refused
+    when it already exists with looser permissions or another owner.
+
+    :param app: Flask application instance
+    :return: None
+    """
+    if not app.config.get('JINJA_BYTECODE_CACHE'):
+        return None
+
+    cache_dir = app.config.get('JINJA_BYTECODE_CACHE_DIR') or os.path.join(app.instance_path, 'jinja-cache')
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    stat = os.stat(cache_dir)
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        raise RuntimeError(f"{cache_dir} must be owned by the app's user and private to it (mode 0700)")
+    app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache(cache_dir))
+    return None
+
+
 def error_templates(app):
     """
     Register 0 or more custom error pages (mutates the app passed in).
@@ -89,31 +168,84 @@ def extensions(app):
     :param app: Flask application instance
     :return: None
     """
-    debug_toolbar.init_app(app)
+    # First, so request timings include the other extensions' hooks.
+    metrics.init_app(app)
+    if app.debug:
+        debug_toolbar.init_app(app)
     csrf.init_app(app)
     db.init_app(app)
     login_manager.init_app(app)
+    fragment_cache.init_app(app)
+    image_pipeline.init_app(app)
+    upload_store.init_app(app)
+    assets.init_app(app)
     Breadcrumbs(app=app)
     return None
 
 
+def instrumentation(app):
+    """
+    Publish the hit ratios of the caches and the connection pool usage with
+    the request metrics (mutates the app passed in).
+
+    :param app: Flask application instance
+    :return: None
+    """
+    if not metrics.enabled:
+        return None
+
+    def cache_stats():
+        caches = {'fragment': fragment_cache.stats(), 'category': category_cache.stats(), 'user': user_cache.stats()}
+        samples = {'hits': [], 'misses': [], 'ratio': []}
+        for name, stats in caches.items():
+            lookups = stats['hits'] + stats['misses']
+            samples['hits'].append(({'cache': name}, stats['hits']))
+            samples['misses'].append(({'cache': name}, stats['misses']))
+            samples['ratio'].append(({'cache': name}, stats['hits'] / lookups if lookups else 0.0))
+        return [
+            ('catalog_cache_hits_total', 'counter', 'Cache lookups answered from the cache.', samples['hits']),
+            ('catalog_cache_misses_total', 'counter', 'Cache lookups that missed.', samples['misses']),
+            ('catalog_cache_hit_ratio', 'gauge', 'Share of cache lookups answered from the cache.',
+             samples['ratio'])
+        ]
+
+    def pool_stats():
+        status = db.pool_status()
+        gauges = [
+            ('checked_out', 'catalog_db_connections_in_use', 'gauge', 'Connections checked out of the pool.'),
+            ('checked_in', 'catalog_db_connections_idle', 'gauge', 'Idle connections in the pool.'),
+            ('size', 'catalog_db_pool_size', 'gauge', 'Connections kept open by the pool.'),
+            ('overflow', 'catalog_db_pool_overflow', 'gauge', 'Connections open beyond the pool size.'),
+            ('connects', 'catalog_db_connects_total', 'counter', 'Database connections opened.'),
+            ('disconnects', 'catalog_db_disconnects_total', 'counter', 'Stale connections found by pings.')
+        ]
+        return [(name, metric_type, documentation,
+                 [({'bind': entry['bind']}, entry[key]) for entry in status if key in entry])
+                for key, name, metric_type, documentation in gauges]
+
+    metrics.register_collector('caches', cache_stats)
+    metrics.register_collector('pools', pool_stats)
+    return None
+
+
 def authentication(app):
     """
     Initialize the Flask-Login extension (mutates the app passed in).
 
+    Users are loaded through the per process user cache, see UserCache.
+
     :param app: Flask application instance
     :return: None
     """
     login_manager.login_view = 'user.login'
 
-    @app.before_request
-    def make_session_permanent():
-        session.permanent = True
-        app.permanent_session_lifetime = datetime.timedelta(minutes=15)
+    # Sessions become permanent when first written to, so anonymous reads
+    # don't get a session cookie.
+    app.session_interface = LazySessionInterface()
 
     @login_manager.user_loader
     def load_user(uid):
-        return User.query.get(int(uid))
+        return user_cache.get(int(uid))
 
 
 def template_processors(app):
@@ -211,7 +343,7 @@ def register_facebook_blueprint(app):
     if app_token:
         app.register_blueprint(facebook_blueprint, url_prefix="/login")
     else:
-        print("Facebook app token not found in config. Facebook blueprint not configured.")
+        logger.warning('Facebook app token not found in config. Facebook blueprint not configured.')
 
     # create/login local user on successful OAuth login
     @oauth_authorized.connect_via(facebook_blueprint)
@@ -222,7 +354,7 @@ def register_facebook_blueprint(app):
         # figure out who the user is
         resp = blueprint.session.get("/me?fields=email,name")
         if resp.ok:
-            print(f"Response from facebook: {resp.json()}")
+            logger.debug('Response from facebook: %s', resp.text)
             username = resp.json()["email"]
             query = User.query.filter_by(username=username)
             try:
@@ -235,7 +367,7 @@ def register_facebook_blueprint(app):
             login_user(user)
             flash("Successfully signed in with Facebook", "success")
         else:
-            print(resp.text)
+            logger.warning('Failed to fetch user info from %s: %s', blueprint.name, resp.text)
             msg = "Failed to fetch user info from {name}".format(name=blueprint.name)
             flash(msg, category="error")
 
@@ -262,7 +394,7 @@ def register_github_blueprint(app):
         # figure out who the user is
         resp = blueprint.session.get("/user")
         if resp.ok:
-            print(f"Response from github: {resp.json()}")
+            logger.debug('Response from github: %s', resp.text)
             username = resp.json()["login"]
             query = User.query.filter_by(username=username)
             try:
@@ -275,7 +407,7 @@ def register_github_blueprint(app):
             login_user(user)
             flash("Successfully signed in with Github", "success")
         else:
-            print(resp.text)
+            logger.warning('Failed to fetch user info from %s: %s', blueprint.name, resp.text)
             msg = "Failed to fetch user info from {name}".format(name=blueprint.name)
             flash(msg, category="error")
 
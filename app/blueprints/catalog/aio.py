@@ -0,0 +1,151 @@
+"""
+The read only JSON API of the catalog on asyncio, for clients too many or
+too slow to each hold a thread of the WSGI app: /api/v1/catalog, item
+lookups and /api/v1/search, with the same responses. Queries are built
+from the tables of the shared models and run on an async driver, see
+AsyncDatabase. Start it with run_async.py.
+"""
+from aiohttp import web
+from flask import json
+from sqlalchemy import select, func, or_, and_
+
+from app.blueprints.catalog.models import Category, Item, CategorySummary, ITEM_FIELDS
+from app.blueprints.catalog.search import BACKENDS as SEARCH_BACKENDS
+from app.lib.aio_database import AsyncDatabase
+
+categories = Category.__table__
+items = Item.__table__
+
+ITEM_COLUMNS = [items.c[field] for field in ITEM_FIELDS]
+
+# Items read and written at a time by catalog_as_json.
+CATALOG_PAGE_SIZE = 500
+
+
+def json_response(data, status=200):
+    # Flask's encoder, so dates are formatted like the WSGI app's.
+    return web.Response(text=json.dumps(data), status=status, content_type='application/json')
+
+
+async def catalog_as_json(request):
+    """
+    Stream the catalog, one category at a time and its items by pages of
+    CATALOG_PAGE_SIZE, so neither the whole catalog nor its JSON is held
+    in memory, and the event loop serves other requests between pages.
+    """
+    database = request.app['database']
+    category_rows = await database.fetch(
+        select([categories.c[field] for field in CategorySummary._fields]).order_by(categories.c.id))
+
+    response = web.StreamResponse(headers={'Content-Type': 'application/json'})
+    await response.prepare(request)
+    response.write(b'{"Categories": [')
+    for index, category in enumerate(category_rows):
+        # The category object, left open for its items.
+        response.write(((', ' if index else '') + json.dumps(category)[:-1] + ', "items": [').encode('utf-8'))
+        last = None
+        while True:
+            # Keyset pages served by ix_item_category_created_on.
+            query = select(ITEM_COLUMNS).where(items.c.category_id == category['id']) \
+                .order_by(items.c.created_on, items.c.id).limit(CATALOG_PAGE_SIZE)
+            if last is not None:
+                query = query.where(or_(items.c.created_on > last['created_on'],
+                                        and_(items.c.created_on == last['created_on'], items.c.id > last['id'])))
+            page = await database.fetch(query)
+            if not page:
+                break
+            response.write(((', ' if last is not None else '') +
+                            ', '.join(json.dumps(item) for item in page)).encode('utf-8'))
+            await response.drain()
+            last = page[-1]
+        response.write(b']}')
+    response.write(b']}')
+    await response.write_eof()
+    return response
+
+
+async def item_as_json(request):
+    # Same lookup as Item.get_item, served by the lower(name) indexes.
+    query = select(ITEM_COLUMNS).select_from(items.join(categories)) \
+        .where(func.lower(categories.c.name) == func.lower(request.match_info['category'])) \
+        .where(func.lower(items.c.name) == func.lower(request.match_info['item']))
+    rows = await request.app['database'].fetch(query)
+    if not rows:
+        raise web.HTTPNotFound()
+    return json_response(rows[0])
+
+
+async def search_items(database, q, page, per_page):
+    """
+    Asynchronous version of search.search_items.
+
+    :return: tuple of (list of item dicts, has_next)
+    """
+    backend = SEARCH_BACKENDS.get(database.dialect.name)
+    offset = (page - 1) * per_page
+
+    if backend is None:
+        pattern = '%{0}%'.format(q.strip())
+        rows = await database.fetch(select(ITEM_COLUMNS)
+                                    .where(items.c.name.ilike(pattern) | items.c.description.ilike(pattern))
+                                    .order_by(items.c.name, items.c.id).limit(per_page + 1).offset(offset))
+        return rows[:per_page], len(rows) > per_page
+
+    query = backend.make_query(q)
+    if query is None:
+        return [], False
+
+    ids = [row[0] for row in await database.fetch(
+        backend.search_sql.bindparams(query=query, limit=per_page + 1, offset=offset))]
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    if not ids:
+        return [], has_next
+
+    by_id = {row['id']: row for row in await database.fetch(select(ITEM_COLUMNS).where(items.c.id.in_(ids)))}
+    return [by_id[item_id] for item_id in ids if item_id in by_id], has_next
+
+
+async def search_as_json(request):
+    config = request.app['config']
+    q = request.query.get('q', '')
+    try:
+        page = int(request.query.get('page', 1))
+        per_page = int(request.query.get('limit', config['ITEMS_PER_PAGE']))
+    except ValueError:
+        raise web.HTTPBadRequest()
+    per_page = max(1, min(per_page, config['API_MAX_PAGE_SIZE']))
+    if page < 1 or not q.strip():
+        raise web.HTTPBadRequest()
+
+    found, has_next = await search_items(request.app['database'], q, page, per_page)
+    return json_response({
+        'items': found,
+        'page': page,
+        'has_next': has_next
+    })
+
+
+async def _connect(app):
+    app['database'] = await AsyncDatabase.connect(app['config'])
+
+
+async def _disconnect(app):
+    await app['database'].close()
+
+
+def create_async_app(config):
+    """
+    Create the aiohttp application serving the read only API.
+
+    :param config: Config of the Flask app, see app.create_app
+    :return: aiohttp Application
+    """
+    app = web.Application()
+    app['config'] = config
+    app.router.add_get('/api/v1/catalog', catalog_as_json)
+    app.router.add_get('/api/v1/catalog/{category}/items/{item}', item_as_json)
+    app.router.add_get('/api/v1/search', search_as_json)
+    app.on_startup.append(_connect)
+    app.on_cleanup.append(_disconnect)
+    return app
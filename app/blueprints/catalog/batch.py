@@ -0,0 +1,264 @@
+from collections import defaultdict
+
+import bleach
+from sqlalchemy import bindparam
+
+from app.blueprints.catalog.importer import LOOKUP_CHUNK_SIZE
+from app.blueprints.catalog.models import Category, Item, refresh_item_counts, refresh_recent_items, category_cache
+from app.extensions import db, fragment_cache
+
+OPERATIONS = ('create', 'update', 'delete')
+
+# Same limit as ItemForm.
+NAME_MAX_LENGTH = 255
+
+
+def _chunks(values, size=LOOKUP_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class ItemBatch(object):
+    """
+    A batch of item creates, updates and deletes sent to the bulk API, all
+    applied in one transaction or not at all.
+
+    Every operation is a dict with an "op" key:
+
+      {"op": "create", "name": ..., "description": ..., "category": <name>
+       or "category_id": <id>, "image": <url, optional>}
+      {"op": "update", "id": <id>, any of the create fields}
+      {"op": "delete", "id": <id>}
+
+    Like check_authorization, only the owner of an item may update or delete
+    it. validate() checks the whole batch against the database with a few
+    set based queries, and apply() writes it with one executemany statement
+    per kind of change. Both fill results with one entry per operation.
+    """
+
+    def __init__(self, operations, username):
+        self.operations = operations
+        self.username = username
+        self.results = []
+        self.existing = {}
+        self._categories = {category.id: category.name for category in Category.get_cached_categories()}
+        self._category_ids = {name.lower(): category_id for category_id, name in self._categories.items()}
+        self._valid = []
+
+    def _clean_fields(self, operation, errors, required):
+        values = {}
+        for field in ('name', 'description'):
+            if field in operation:
+                value = operation[field]
+                if not isinstance(value, str) or not value.strip():
+                    errors.append(f"{field} must be a non empty string")
+                    continue
+                values[field] = bleach.clean(value.strip())
+            elif required:
+                errors.append(f"{field} is required")
+
+        if len(values.get('name', '')) > NAME_MAX_LENGTH:
+            errors.append(f"name is longer than {NAME_MAX_LENGTH} characters")
+
+        if 'category_id' in operation:
+            if not isinstance(operation['category_id'], int) or operation['category_id'] not in self._categories:
+                errors.append("unknown category_id")
+            else:
+                values['category_id'] = operation['category_id']
+        elif 'category' in operation:
+            category_id = self._category_ids.get(str(operation['category']).lower())
+            if category_id is None:
+                errors.append("unknown category")
+            else:
+                values['category_id'] = category_id
+        elif required:
+            errors.append("category or category_id is required")
+
+        if 'image' in operation:
+            if operation['image'] is not None and not isinstance(operation['image'], str):
+                errors.append("image must be a string or null")
+            else:
+                values['image'] = operation['image'] or None
+        return values
+
+    def _load_existing(self, ids):
+        table = Item.__table__
+        for chunk in _chunks(ids):
+            query = table.select().with_only_columns(
+                [table.c.id, table.c.name, table.c.category_id, table.c.created_by, table.c.image]) \
+                .where(table.c.id.in_(chunk))
+            for row in db.session.execute(query):
+                self.existing[row.id] = row
+
+    def _occupied_keys(self, keys):
+        """
+        Ids of the existing items holding some (name, category_id) keys.
+        """
+        table = Item.__table__
+        names_by_category = defaultdict(set)
+        for name, category_id in keys:
+            names_by_category[category_id].add(name)
+
+        occupied = {}
+        for category_id, names in names_by_category.items():
+            for chunk in _chunks(names):
+                query = table.select().with_only_columns([table.c.id, table.c.name]) \
+                    .where(table.c.category_id == category_id).where(table.c.name.in_(chunk))
+                for item_id, name in db.session.execute(query):
+                    occupied[(name, category_id)] = item_id
+        return occupied
+
+    def validate(self):
+        """
+        Check every operation and fill results, with the errors of the invalid
+        ones.
+
+        :return: True when the whole batch is valid
+        """
+        ids = [operation.get('id') for operation in self.operations
+               if isinstance(operation, dict) and isinstance(operation.get('id'), int)]
+        self._load_existing(ids)
+        seen_ids = set()
+        rows = []
+
+        for index, operation in enumerate(self.operations):
+            errors = []
+            op = operation.get('op') if isinstance(operation, dict) else None
+            if op not in OPERATIONS:
+                rows.append((index, op, None, None, ["op must be one of create, update or delete"]))
+                continue
+
+            item_id = None
+            if op != 'create':
+                item_id = operation.get('id')
+                if not isinstance(item_id, int):
+                    rows.append((index, op, None, None, ["id must be an integer"]))
+                    continue
+                current = self.existing.get(item_id)
+                if current is None:
+                    errors.append("no item with this id")
+                elif current.created_by != self.username:
+                    errors.append("not authorized")
+                if item_id in seen_ids:
+                    errors.append("item appears more than once in the batch")
+                seen_ids.add(item_id)
+
+            values = {} if op == 'delete' else self._clean_fields(operation, errors, required=op == 'create')
+            if op == 'update' and not values and not errors:
+                errors.append("nothing to update")
+            rows.append((index, op, item_id, values, errors))
+
+        # Items whose key is freed by a delete or a rename, and keys claimed
+        # by the batch.
+        deleted = set()
+        renamed = set()
+        claims = {}
+        for index, op, item_id, values, errors in rows:
+            if errors:
+                continue
+            if op != 'create':
+                current = self.existing[item_id]
+                old_key = (current.name, current.category_id)
+                new_key = (values.get('name', current.name), values.get('category_id', current.category_id))
+                if op == 'delete':
+                    deleted.add(item_id)
+                    continue
+                if new_key == old_key:
+                    continue
+                renamed.add(item_id)
+            else:
+                new_key = (values['name'], values['category_id'])
+            if new_key in claims:
+                errors.append("another item of the batch has this name in this category")
+            claims[new_key] = index
+
+        occupied = self._occupied_keys(claims)
+        for index, op, item_id, values, errors in rows:
+            if errors or op == 'delete':
+                continue
+            key = (values.get('name', self.existing[item_id].name if item_id else None),
+                   values.get('category_id', self.existing[item_id].category_id if item_id else None))
+            holder = occupied.get(key)
+            if holder is None or holder == item_id or holder in deleted:
+                continue
+            if holder in renamed and op == 'create':
+                # Inserts run after every update.
+                continue
+            if holder in renamed:
+                # Updates run in one statement, whose rows may be written
+                # in any order: the unique constraint would see both.
+                errors.append("another item of the batch is renamed from this name, rename it in a separate batch")
+            else:
+                errors.append("an item with this name already exists in this category")
+
+        self.results = []
+        self._valid = []
+        for index, op, item_id, values, errors in rows:
+            if errors:
+                self.results.append({'index': index, 'op': op, 'id': item_id, 'status': 'invalid', 'errors': errors})
+            else:
+                self.results.append({'index': index, 'op': op, 'id': item_id, 'status': 'not_applied'})
+                self._valid.append((index, op, item_id, values))
+        return len(self._valid) == len(rows)
+
+    def apply(self):
+        """
+        Write a validated batch in one transaction: deletes, then updates
+        grouped by the columns they set, then inserts. Timestamps are set by
+        the column defaults.
+
+        :return: results
+        """
+        table = Item.__table__
+        deletes = [item_id for _, op, item_id, _ in self._valid if op == 'delete']
+        updates = defaultdict(list)
+        inserts = []
+        categories = set()
+
+        for index, op, item_id, values in self._valid:
+            if op == 'create':
+                inserts.append(dict(values, created_by=self.username, image=values.get('image')))
+                categories.add(values['category_id'])
+                continue
+
+            current = self.existing[item_id]
+            categories.add(current.category_id)
+            if op == 'update' and values.get('image', current.image) != current.image:
+                # Variants of the previous image, like upload_image.
+                values = dict(values, thumbnail=None, web_image=None)
+            if op == 'update':
+                categories.add(values.get('category_id', current.category_id))
+                updates[tuple(sorted(values))].append(dict(values, _id=item_id))
+
+        try:
+            for chunk in _chunks(deletes):
+                db.session.execute(table.delete().where(table.c.id.in_(chunk)))
+            for columns, rows in updates.items():
+                statement = table.update().where(table.c.id == bindparam('_id')) \
+                    .values(**{column: bindparam(column) for column in columns})
+                db.session.execute(statement, rows)
+            if inserts:
+                db.session.execute(table.insert(), inserts)
+
+            # Core statements bypass the session events maintaining these.
+            refresh_item_counts(db.session, categories)
+            refresh_recent_items(db.session)
+
+            created = self._occupied_keys([(row['name'], row['category_id']) for row in inserts])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        category_cache.invalidate()
+        fragment_cache.clear()
+
+        statuses = {'create': 'created', 'update': 'updated', 'delete': 'deleted'}
+        valid = {index: values for index, _, _, values in self._valid}
+        for result in self.results:
+            result['status'] = statuses[result['op']]
+            if result['op'] == 'create':
+                values = valid[result['index']]
+                result['id'] = created.get((values['name'], values['category_id']))
+        return self.results
@@ -0,0 +1,261 @@
+import time
+
+from flask import json
+from sqlalchemy import event, DDL, func, text
+from sqlalchemy.dialects import sqlite
+
+from app.blueprints.catalog.models import Category, Item, Change
+from app.extensions import db
+from app.lib.util_sqlalchemy import utcnow
+from app.lib.util_pagination import encode_cursor
+
+# Arbitrary key of the advisory lock serializing writes to the change log.
+CHANGE_LOG_LOCK = 4208
+
+# Seconds between the keep alive comments of an idle event stream.
+KEEPALIVE_SECONDS = 15
+
+# Columns of a category whose changes are published. item_count is
+# rewritten on every item change and would flood the feed.
+CATEGORY_COLUMNS = ('name', 'description', 'image')
+
+
+# Logs the row of a trigger, the entity name being its argument.
+POSTGRES_FUNCTION = (
+    "CREATE OR REPLACE FUNCTION record_catalog_change() RETURNS trigger AS $$ "
+    "BEGIN "
+    f"PERFORM pg_advisory_xact_lock({CHANGE_LOG_LOCK}); "
+    "IF TG_OP = 'DELETE' THEN "
+    "INSERT INTO change_log (entity, entity_id, operation, changed_on) "
+    "VALUES (TG_ARGV[0], OLD.id, 'delete', timezone('utc', now())); "
+    "RETURN OLD; "
+    "END IF; "
+    "INSERT INTO change_log (entity, entity_id, operation, changed_on) "
+    "VALUES (TG_ARGV[0], NEW.id, lower(TG_OP), timezone('utc', now())); "
+    "RETURN NEW; "
+    "END "
+    "$$ LANGUAGE plpgsql"
+)
+
+
+def _sqlite_triggers(table, update_columns=None):
+    update = f'UPDATE OF {", ".join(update_columns)}' if update_columns else 'UPDATE'
+    # The format of the other dates, which changed_on is compared with.
+    now = utcnow().compile(dialect=sqlite.dialect())
+    statements = []
+    for suffix, event_name, row in (('ai', 'INSERT', 'new'), ('au', update, 'new'), ('ad', 'DELETE', 'old')):
+        operation = event_name.split()[0].lower()
+        statements.extend([
+            f"DROP TRIGGER IF EXISTS change_log_{table}_{suffix}",
+            f"CREATE TRIGGER change_log_{table}_{suffix} AFTER {event_name} ON {table} BEGIN "
+            f"INSERT INTO change_log (entity, entity_id, operation, changed_on) "
+            f"VALUES ('{table}', {row}.id, '{operation}', {now}); "
+            f"END"
+        ])
+    return statements
+
+
+def _postgres_triggers(table, update_columns=None):
+    update = f'UPDATE OF {", ".join(update_columns)}' if update_columns else 'UPDATE'
+    return [
+        POSTGRES_FUNCTION,
+        f"DROP TRIGGER IF EXISTS change_log_{table} ON {table}",
+        f"CREATE TRIGGER change_log_{table} AFTER INSERT OR {update} OR DELETE ON {table} "
+        f"FOR EACH ROW EXECUTE PROCEDURE record_catalog_change('{table}')"
+    ]
+
+
+class SQLiteChangeBackend(object):
+    """
+    Triggers inserting a change_log row for every changed row. SQLite has a
+    single writer at a time, so change ids are allocated in commit order.
+    """
+    dialect = 'sqlite'
+
+    # Changes logged by the first triggers, with whole second dates.
+    repair = ("UPDATE change_log SET changed_on = changed_on || '.000000' "
+              "WHERE length(changed_on) = 19",)
+
+    ddl = {
+        'item': _sqlite_triggers('item'),
+        'category': _sqlite_triggers('category', CATEGORY_COLUMNS)
+    }
+
+
+class PostgresChangeBackend(object):
+    """
+    Triggers inserting a change_log row for every changed row.
+
+    The ids of concurrent transactions could become visible out of order,
+    and a client polling with the last id it saw would then skip the change
+    committed late. Writers take an advisory lock before logging, held until
+    they commit, so change ids are allocated in commit order.
+    """
+    dialect = 'postgresql'
+
+    repair = ()
+
+    ddl = {
+        'item': _postgres_triggers('item'),
+        'category': _postgres_triggers('category', CATEGORY_COLUMNS)
+    }
+
+
+BACKENDS = {backend.dialect: backend for backend in (SQLiteChangeBackend, PostgresChangeBackend)}
+
+# Created along with the logged tables: triggers may refer to change_log
+# before it exists.
+for _backend in BACKENDS.values():
+    for _model in (Item, Category):
+        for _statement in _backend.ddl[_model.__tablename__]:
+            # DDL formats its statement with %.
+            event.listen(_model.__table__, 'after_create',
+                         DDL(_statement.replace('%', '%%')).execute_if(dialect=_backend.dialect))
+
+
+def install_triggers():
+    """
+    Create the change log in an existing database if needed, and create or
+    replace its triggers.
+
+    :return: None
+    """
+    backend = BACKENDS.get(db.engine.dialect.name)
+    if backend is None:
+        return None
+
+    Change.__table__.create(db.engine, checkfirst=True)
+    with db.engine.begin() as connection:
+        for statements in backend.ddl.values():
+            for statement in statements:
+                connection.execute(text(statement))
+        for statement in backend.repair:
+            connection.execute(text(statement))
+    return None
+
+
+def prune_changes(older_than):
+    """
+    Delete the changes logged before a date. The latest change is always
+    kept, so the feed can tell clients that missed pruned changes.
+
+    :param older_than: datetime
+    :return: Number of deleted changes
+    """
+    latest = latest_change_id()
+    deleted = Change.query.filter(Change.changed_on < older_than, Change.id < latest) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def latest_change_id():
+    return db.session.query(func.max(Change.id)).scalar() or 0
+
+
+def is_pruned(after):
+    """
+    Tell whether changes following a cursor may have been pruned, in which
+    case the client has to download the catalog again.
+
+    :param after: Id of the last change seen by the client
+    :return: bool
+    """
+    if not after:
+        return False
+    oldest = db.session.query(func.min(Change.id)).scalar()
+    return oldest is not None and after < oldest - 1
+
+
+def read_changes(after, limit):
+    """
+    Read the changes following a cursor, oldest first.
+
+    :param after: Id of the last change seen by the client
+    :param limit: Most changes returned
+    :return: list of Change
+    """
+    return Change.query.filter(Change.id > after).order_by(Change.id).limit(limit).all()
+
+
+def wait_for_changes(after, limit, wait, interval):
+    """
+    Read the changes following a cursor, polling for up to wait seconds
+    while there are none.
+
+    :param after: Id of the last change seen by the client
+    :param limit: Most changes returned
+    :param wait: Seconds to wait for changes
+    :param interval: Seconds between polls
+    :return: list of Change
+    """
+    deadline = time.time() + wait
+    changes = read_changes(after, limit)
+    while not changes and time.time() < deadline:
+        # Don't hold a connection, or a transaction, while sleeping.
+        db.session.close()
+        time.sleep(min(interval, max(deadline - time.time(), 0)))
+        changes = read_changes(after, limit)
+    return changes
+
+
+def serialize_changes(changes):
+    """
+    Serialize changes along with the current state of their item or
+    category, loaded with one query per kind. The state is null once the
+    row is deleted.
+
+    :param changes: list of Change
+    :return: list of dicts
+    """
+    ids = {'item': set(), 'category': set()}
+    for change in changes:
+        ids[change.entity].add(change.entity_id)
+
+    current = {'item': {}, 'category': {}}
+    if ids['item']:
+        current['item'] = {item.id: item.serialize for item in Item.query.filter(Item.id.in_(ids['item']))}
+    if ids['category']:
+        current['category'] = {category.id: category.serialize_summary for category in
+                               Category.query.filter(Category.id.in_(ids['category']))}
+
+    return [{
+        'cursor': encode_cursor(change.id),
+        'entity': change.entity,
+        'id': change.entity_id,
+        'operation': change.operation,
+        'changed_on': change.changed_on,
+        'data': current[change.entity].get(change.entity_id)
+    } for change in changes]
+
+
+def iter_events(after, limit, interval, timeout):
+    """
+    Stream the changes following a cursor as server-sent events, for up to
+    timeout seconds. Clients reconnect with the Last-Event-ID header.
+
+    :param after: Id of the last change seen by the client
+    :param limit: Most changes read per poll
+    :param interval: Seconds between polls
+    :param timeout: Seconds before the stream is closed
+    :return: generator of str
+    """
+    deadline = time.time() + timeout
+    yield f'retry: {int(interval * 1000)}\n\n'
+    last_sent = time.time()
+
+    while time.time() < deadline:
+        changes = read_changes(after, limit)
+        for change in serialize_changes(changes):
+            yield f"id: {change['cursor']}\nevent: change\ndata: {json.dumps(change)}\n\n"
+        if changes:
+            after = changes[-1].id
+            last_sent = time.time()
+            continue
+
+        db.session.close()
+        if time.time() - last_sent >= KEEPALIVE_SECONDS:
+            yield ': keepalive\n\n'
+            last_sent = time.time()
+        time.sleep(interval)
+
@@ -0,0 +1,85 @@
+import csv
+import io
+import json
+import zlib
+
+from sqlalchemy import func
+
+from app.blueprints.catalog.models import Category, Item
+
+EXPORT_COLUMNS = ('name', 'description', 'category', 'image', 'created_on', 'updated_on', 'created_by')
+
+
+def export_rows(category_names=None, updated_since=None, updated_until=None, batch_size=1000):
+    """
+    Query the items to export as plain rows, in id order. Rows are fetched
+    batch_size at a time through a server side cursor where the driver
+    supports one, so memory use stays flat whatever the catalog size.
+
+    :param category_names: Only export items of these categories
+    :param updated_since: Only export items updated at or after this time
+    :param updated_until: Only export items updated before this time
+    :param batch_size: Rows fetched per round trip
+    :return: Iterable of rows with EXPORT_COLUMNS
+    """
+    query = Item.query.join(Item.category).with_entities(
+        Item.name, Item.description, Category.name, Item.image, Item.created_on, Item.updated_on, Item.created_by)
+
+    if category_names:
+        # Served by ix_category_lower_name, like the other category lookups.
+        query = query.filter(func.lower(Category.name).in_([name.lower() for name in category_names]))
+    if updated_since is not None:
+        query = query.filter(Item.updated_on >= updated_since)
+    if updated_until is not None:
+        query = query.filter(Item.updated_on < updated_until)
+
+    return query.order_by(Item.id).execution_options(stream_results=True).yield_per(batch_size)
+
+
+def _format_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def iter_jsonl(rows):
+    """
+    Yield one JSON document per item, in the JSON Lines format read by the
+    import command.
+    """
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_COLUMNS, map(_format_value, row)))) + '\n'
+
+
+def iter_csv(rows, rows_per_chunk=500):
+    """
+    Yield CSV text with a header row, in chunks of rows_per_chunk rows.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+
+    for index, row in enumerate(rows, 1):
+        writer.writerow([_format_value(value) for value in row])
+        if index % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def iter_gzip(chunks, level=6):
+    """
+    Compress a stream of text chunks into a gzip stream, incrementally.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+FORMATTERS = {
+    'jsonl': (iter_jsonl, 'application/x-ndjson'),
+    'csv': (iter_csv, 'text/csv')
+}
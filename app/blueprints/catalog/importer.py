@@ -0,0 +1,320 @@
+import csv
+import datetime
+import io
+import json
+import time
+from collections import defaultdict
+
+from sqlalchemy import bindparam, text, func
+
+from app.blueprints.catalog.models import Category, Item, refresh_catalog_stats
+from app.lib.util_sqlalchemy import utcnow
+
+DATE_FORMATS = ('%a, %d %b %Y %H:%M:%S GMT', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S',
+                '%Y-%m-%d')
+
+# Stay below the bound parameter limit of older SQLite builds (999).
+LOOKUP_CHUNK_SIZE = 500
+
+ITEM_COLUMNS = ('name', 'description', 'image', 'category_id', 'created_on', 'updated_on', 'created_by')
+
+
+class CatalogImportError(ValueError):
+    pass
+
+
+def parse_date(value):
+    """
+    Parse the dates found in catalog files: the HTTP date format produced by
+    the JSON API or ISO 8601.
+
+    :param value: Date string, datetime or None
+    :return: datetime or None
+    """
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise CatalogImportError(f"Unrecognised date {value!r}")
+
+
+def iter_json_array(stream, chunk_size=1 << 16):
+    """
+    Yield the objects of a JSON array without loading the whole document.
+
+    The array is either the top level value or the first array in the
+    document, as in {"Catalog": [...]}. Its elements must be objects.
+
+    :param stream: Text file object
+    :param chunk_size: Characters read at a time
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+
+    while True:
+        index = buffer.find('[', position)
+        if index != -1:
+            position = index + 1
+            break
+        position = len(buffer)
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            raise CatalogImportError("No JSON array found")
+        buffer += chunk
+
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+
+        if position == len(buffer):
+            buffer = stream.read(chunk_size)
+            position = 0
+            if not buffer:
+                raise CatalogImportError("Unexpected end of JSON array")
+            continue
+
+        if buffer[position] == ']':
+            return
+
+        try:
+            value, position = decoder.raw_decode(buffer, position)
+        except ValueError:
+            # Incomplete object: read at least as much again as is buffered
+            # so large objects are decoded in amortised linear time.
+            chunk = stream.read(max(chunk_size, len(buffer) - position))
+            if not chunk:
+                raise
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+
+        yield value
+        if position > chunk_size:
+            buffer = buffer[position:]
+            position = 0
+
+
+def iter_records(stream, file_format):
+    """
+    Yield ('category', dict) and ('item', dict) records from a catalog file.
+
+    json:  The format of catalog.json, categories with nested items.
+    jsonl: One object per line. Objects with a "category" key are items of
+           the category with that name, objects with a "category_id" key
+           items of the category with that "id" earlier in the file, other
+           objects are categories.
+    csv:   One item per row with name, description, category and optionally
+           image, created_on and updated_on columns.
+
+    :param stream: Text file object
+    :param file_format: 'json', 'jsonl' or 'csv'
+    """
+    if file_format == 'json':
+        for category in iter_json_array(stream):
+            items = category.pop('items', [])
+            yield 'category', category
+            for item in items:
+                item['category'] = category['name']
+                yield 'item', item
+    elif file_format == 'jsonl':
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            yield ('item' if 'category' in record or 'category_id' in record else 'category'), record
+    elif file_format == 'csv':
+        for row in csv.DictReader(stream):
+            yield 'item', row
+    else:
+        raise CatalogImportError(f"Unknown format {file_format!r}")
+
+
+class CatalogImporter(object):
+    """
+    Upsert catalog records in batches of plain Core statements.
+
+    Categories are matched by name and new ones get their id from the
+    database; the ids of the file only link items to their category. Missing
+    dates are left to the column defaults, i.e. the database clock.
+
+    Items are matched on the _item_category_uc key (name, category). On
+    PostgreSQL each batch is COPYed into a temporary table and merged with
+    INSERT ... ON CONFLICT, elsewhere existing rows are looked up and the
+    batch is written with one executemany UPDATE and one executemany INSERT.
+    """
+
+    def __init__(self, connection, batch_size=1000, created_by=None, progress=None):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.created_by = created_by
+        self.progress = progress
+        self.categories = {name: category_id for category_id, name in
+                           connection.execute(Category.__table__.select().with_only_columns(
+                               [Category.__table__.c.id, Category.__table__.c.name]))}
+        self.file_category_ids = {}
+        self.batch = {}
+        self.items = 0
+        self.started = time.time()
+        self.use_copy = connection.dialect.name == 'postgresql'
+
+        if self.use_copy:
+            self.connection.execute(text(
+                "CREATE TEMP TABLE IF NOT EXISTS item_import ("
+                "name VARCHAR(256), description TEXT, image TEXT, category_id INTEGER, "
+                "created_on TIMESTAMP, updated_on TIMESTAMP, created_by TEXT) ON COMMIT DELETE ROWS"))
+
+    @property
+    def rate(self):
+        elapsed = time.time() - self.started
+        return self.items / elapsed if elapsed else 0.0
+
+    def run(self, records):
+        for kind, record in records:
+            if kind == 'category':
+                self.add_category(record)
+            else:
+                self.add_item(record)
+        self.flush()
+        # Core statements bypass the session events maintaining these.
+        with self.connection.begin():
+            refresh_catalog_stats(self.connection)
+        return self.items
+
+    def add_category(self, record):
+        table = Category.__table__
+        # Only overwrite the fields present in the record.
+        values = {key: record[key] for key in ('description', 'image') if key in record}
+        for key in ('created_on', 'updated_on'):
+            if record.get(key):
+                values[key] = parse_date(record[key])
+
+        with self.connection.begin():
+            category_id = self.categories.get(record['name'])
+            if category_id is None:
+                result = self.connection.execute(table.insert().values(name=record['name'], **values))
+                category_id = self.categories[record['name']] = result.inserted_primary_key[0]
+            else:
+                values.pop('created_on', None)
+                self.connection.execute(table.update().where(table.c.id == category_id).values(**values))
+
+        if record.get('id') is not None:
+            self.file_category_ids[int(record['id'])] = category_id
+
+    def _category_id(self, record):
+        name = record.get('category')
+        if not name:
+            try:
+                return self.file_category_ids[int(record['category_id'])]
+            except (KeyError, TypeError, ValueError):
+                raise CatalogImportError(f"Item of an unknown category: {record!r}")
+        if name not in self.categories:
+            self.add_category({'name': name})
+        return self.categories[name]
+
+    def add_item(self, record):
+        if not record.get('name') or not (record.get('category') or record.get('category_id') is not None):
+            raise CatalogImportError(f"Item without name or category: {record!r}")
+
+        row = {
+            'name': record['name'],
+            'description': record.get('description'),
+            'image': record.get('image') or None,
+            'category_id': self._category_id(record),
+            'created_on': parse_date(record.get('created_on') or None),
+            'updated_on': parse_date(record.get('updated_on') or None),
+            'created_by': record.get('created_by') or self.created_by
+        }
+        # Later duplicates of a key replace earlier ones within a batch.
+        self.batch[(row['name'], row['category_id'])] = row
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        rows = list(self.batch.values())
+        self.batch = {}
+
+        with self.connection.begin():
+            if self.use_copy:
+                self._copy_upsert(rows)
+            else:
+                self._upsert(rows)
+
+        self.items += len(rows)
+        if self.progress:
+            self.progress(self)
+
+    def _copy_upsert(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([r'\N' if row[column] is None else row[column] for column in ITEM_COLUMNS])
+        buffer.seek(0)
+
+        columns = ', '.join(ITEM_COLUMNS)
+        cursor = self.connection.connection.cursor()
+        cursor.copy_expert(f"COPY item_import ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+        cursor.close()
+
+        # Missing dates are taken from the database clock, like the column
+        # defaults.
+        now = utcnow().compile(dialect=self.connection.dialect)
+        selected = ', '.join(f'COALESCE({column}, {now})' if column in ('created_on', 'updated_on') else column
+                             for column in ITEM_COLUMNS)
+        self.connection.execute(text(
+            f"INSERT INTO item ({columns}) SELECT {selected} FROM item_import "
+            "ON CONFLICT ON CONSTRAINT _item_category_uc DO UPDATE SET "
+            "description = EXCLUDED.description, "
+            "image = COALESCE(EXCLUDED.image, item.image), "
+            "updated_on = EXCLUDED.updated_on"))
+
+    def _upsert(self, rows):
+        table = Item.__table__
+        keys = [(row['name'], row['category_id']) for row in rows]
+
+        names_by_category = defaultdict(list)
+        for name, category_id in keys:
+            names_by_category[category_id].append(name)
+
+        existing = {}
+        for category_id, names in names_by_category.items():
+            for start in range(0, len(names), LOOKUP_CHUNK_SIZE):
+                query = table.select().with_only_columns([table.c.id, table.c.name]) \
+                    .where(table.c.category_id == category_id) \
+                    .where(table.c.name.in_(names[start:start + LOOKUP_CHUNK_SIZE]))
+                for item_id, name in self.connection.execute(query):
+                    existing[(name, category_id)] = item_id
+
+        updates = []
+        inserts = []
+        for key, row in zip(keys, rows):
+            if key in existing:
+                updates.append({'_id': existing[key], 'description': row['description'],
+                                '_image': row['image'], '_updated_on': row['updated_on']})
+            else:
+                inserts.append({'name': row['name'], 'description': row['description'], 'image': row['image'],
+                                'category_id': row['category_id'], 'created_by': row['created_by'],
+                                '_created_on': row['created_on'], '_updated_on': row['updated_on']})
+
+        # Missing dates are taken from the database clock, like the column
+        # defaults. The parameters are typed so dates are stored in the
+        # format the other queries compare with.
+        if updates:
+            self.connection.execute(
+                table.update().where(table.c.id == bindparam('_id')).values(
+                    description=bindparam('description'),
+                    image=func.coalesce(bindparam('_image'), table.c.image),
+                    updated_on=func.coalesce(bindparam('_updated_on', type_=table.c.updated_on.type), utcnow())),
+                updates)
+        if inserts:
+            self.connection.execute(
+                table.insert().values(
+                    created_on=func.coalesce(bindparam('_created_on', type_=table.c.created_on.type), utcnow()),
+                    updated_on=func.coalesce(bindparam('_updated_on', type_=table.c.updated_on.type), utcnow())),
+                inserts)
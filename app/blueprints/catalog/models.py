@@ -1,15 +1,110 @@
-from sqlalchemy import func, UniqueConstraint
+import threading
+import time
+from collections import namedtuple, Counter
+
+from flask import current_app, g, has_request_context
+from sqlalchemy import func, UniqueConstraint, Index, or_, and_, event, select, bindparam, inspect
+from sqlalchemy.orm import contains_eager, joinedload
 
 from app.blueprints.user.models import User
-from app.extensions import db
+from app.extensions import db, fragment_cache
+from app.lib.database import read_from_primary
 from app.mixins.sqlalchemy_resource_mixin import ResourceMixin
 
 
+CategorySummary = namedtuple('CategorySummary', ['id', 'name', 'description', 'image', 'created_on', 'updated_on',
+                                                 'item_count'])
+
+# Fields of an item in the JSON APIs, see Item.serialize.
+ITEM_FIELDS = ('id', 'name', 'description', 'image', 'thumbnail', 'category_id', 'created_on', 'updated_on')
+
+
+class CategoryCache(object):
+    """
+    Process local cache of the category list. Categories are read on nearly
+    every request but rarely change, so the list is kept as plain tuples
+    until a category is saved or deleted in this process. Writes of other
+    processes are noticed by reading the latest category change in the
+    change log, at most once every CATEGORY_CACHE_CHECK_SECONDS.
+
+    The item counts of the cached categories are not kept up to date: pages
+    showing them read the categories with Category.get_summaries().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._categories = None
+        self._version = None
+        self._checked_until = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self):
+        """
+        Return all categories ordered by name, loading them if needed.
+
+        :return: list of CategorySummary
+        """
+        categories = self._categories
+        if categories is not None and time.time() < self._checked_until:
+            self.hits += 1
+            return categories
+
+        # Read before the categories: a change committed in between only
+        # causes another reload.
+        version = category_version()
+        checked_until = time.time() + current_app.config.get('CATEGORY_CACHE_CHECK_SECONDS', 5)
+        if categories is not None and self._version == version:
+            self.hits += 1
+            self._checked_until = checked_until
+            return categories
+
+        self.misses += 1
+        # Labelled with the version read above, which the replica may lag.
+        with read_from_primary():
+            categories = Category.get_summaries()
+        with self._lock:
+            self._categories = categories
+            self._version = version
+            self._checked_until = checked_until
+        return categories
+
+    def invalidate(self):
+        with self._lock:
+            self._categories = None
+            self._version = None
+            self._checked_until = 0
+        if has_request_context():
+            g.pop('category_version', None)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def category_version():
+    """
+    Id of the latest logged change of a category, read once per request.
+
+    :return: int or None
+    """
+    if has_request_context() and 'category_version' in g:
+        return g.category_version
+    version = db.session.query(func.max(Change.id)).filter(Change.entity == 'category').scalar()
+    if has_request_context():
+        g.category_version = version
+    return version
+
+
+category_cache = CategoryCache()
+
+
 class Category(db.Model, ResourceMixin):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(256), unique=True)
     description = db.Column(db.String(), unique=False)
     image = db.Column(db.String())
+    # Maintained on every flush of items, see _maintain_catalog_stats.
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def __init__(self, **kwargs):
         # Call Flask-SQLAlchemy's constructor.
@@ -22,30 +117,114 @@ class Category(db.Model, ResourceMixin):
 
     @classmethod
     def category_details(cls, name):
+        # Served by ix_category_lower_name.
         return Category.query.filter(func.lower(Category.name) == func.lower(name)).one()
 
+    @classmethod
+    def get_summaries(cls):
+        """
+        Read all categories ordered by name, with their current item counts.
+
+        :return: list of CategorySummary
+        """
+        rows = Category.query.with_entities(*[getattr(Category, field) for field in CategorySummary._fields]) \
+            .order_by(Category.name).all()
+        return [CategorySummary(*row) for row in rows]
+
+    @classmethod
+    def get_cached_categories(cls):
+        return category_cache.get()
+
     @classmethod
     def get_categories_as_list(cls):
-        return [category[0] for category in Category.query.with_entities(Category.name).all()]
+        return [category.name for category in category_cache.get()]
 
     @classmethod
     def get_categories_as_dict(cls):
-        return {category[0]: category[1] for category in Category.query.with_entities(Category.id, Category.name).all()}
+        return {category.id: category.name for category in category_cache.get()}
+
+    def after_save(self):
+        category_cache.invalidate()
+        fragment_cache.clear()
+
+    def after_delete(self):
+        category_cache.invalidate()
+        fragment_cache.clear()
 
     def get_items(self):
         return Item.query.join(Category).filter(Category.id == self.id)
 
+    @property
+    def serialize_summary(self):
+        return {field: getattr(self, field) for field in CategorySummary._fields}
+
     @property
     def serialize(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'description': self.description,
-            'image': self.image,
-            'created_on': self.created_on,
-            'updated_on': self.updated_on,
-            'items': [item.serialize for item in self.get_items()]
-        }
+        result = self.serialize_summary
+        result['items'] = [item.serialize for item in self.get_items()]
+        return result
+
+
+# Case insensitive lookups by name filter on lower(name), which the plain
+# unique constraints can't serve.
+Index('ix_category_lower_name', func.lower(Category.name))
+# Latest update of the categories, see catalog_validators.
+Index('ix_category_updated_on', Category.updated_on)
+
+
+# Columns of every supported item sort, see Item.sort_columns. Columns of
+# the category are prefixed with "category.".
+SORT_KEYS = {
+    'id': ('id',),
+    'name': ('name', 'id'),
+    'created_on': ('created_on', 'id'),
+    'updated_on': ('updated_on', 'id'),
+    'category': ('category.name', 'created_on', 'id'),
+}
+
+
+def _seek_after(columns, values, descending=False):
+    """
+    Build the row value comparison (columns) > (values), or < when
+    descending, spelled out with AND/OR so every database can use an index
+    on the columns.
+
+    :return: SQLAlchemy clause
+    """
+    clauses = []
+    for index, column in enumerate(columns):
+        equal = [c == v for c, v in zip(columns[:index], values[:index])]
+        beyond = column < values[index] if descending else column > values[index]
+        clauses.append(and_(*(equal + [beyond])))
+    return or_(*clauses)
+
+
+def catalog_validators():
+    """
+    Cheap validators of the whole catalog for conditional requests, computed
+    in a single statement. The row counts catch deletes, which do not move
+    the latest updated_on; items are counted from the maintained
+    Category.item_count rather than by scanning the item table.
+
+    Last-Modified also covers the latest logged change, whose time moves
+    with deletes too, so If-Modified-Since never validates a page missing
+    a deletion.
+
+    :return: tuple of (version string, last modified datetime or None)
+    """
+    stats = db.session.query(
+        db.session.query(func.max(Item.updated_on)).as_scalar(),
+        db.session.query(func.sum(Category.item_count)).as_scalar(),
+        db.session.query(func.max(Category.updated_on)).as_scalar(),
+        db.session.query(func.count(Category.id)).as_scalar(),
+        db.session.query(func.max(Change.changed_on)).as_scalar()
+    ).one()
+    item_updated_on, item_count, category_updated_on, category_count, changed_on = stats
+
+    timestamps = [ts for ts in (item_updated_on, category_updated_on, changed_on) if ts is not None]
+    last_modified = max(timestamps) if timestamps else None
+    return '{0}:{1}:{2}:{3}:{4}'.format(item_updated_on, item_count, category_updated_on, category_count,
+                                        changed_on), last_modified
 
 
 class Item(db.Model, ResourceMixin):
@@ -53,6 +232,9 @@ class Item(db.Model, ResourceMixin):
     name = db.Column(db.String(256))
     description = db.Column(db.String())
     image = db.Column(db.String())
+    # Resized variants of image, written by the image pipeline.
+    thumbnail = db.Column(db.String())
+    web_image = db.Column(db.String())
     category_id = db.Column(db.Integer, db.ForeignKey(Category.id,
                                                       onupdate="CASCADE",
                                                       ondelete="CASCADE"))
@@ -61,6 +243,13 @@ class Item(db.Model, ResourceMixin):
     created_by = db.Column(db.String(), db.ForeignKey(User.username))
 
     __table_args__ = (UniqueConstraint('name', 'category_id', name='_item_category_uc'),
+                      Index('ix_item_category_created_on', 'category_id', 'created_on', 'id'),
+                      Index('ix_item_category_updated_on', 'category_id', 'updated_on', 'id'),
+                      Index('ix_item_category_name', 'category_id', 'name', 'id'),
+                      Index('ix_item_created_on', 'created_on', 'id'),
+                      Index('ix_item_updated_on', 'updated_on', 'id'),
+                      Index('ix_item_name', 'name', 'id'),
+                      Index('ix_item_image', 'image'),
                       )
 
     # noinspection PyArgumentList
@@ -70,19 +259,248 @@ class Item(db.Model, ResourceMixin):
 
     @classmethod
     def get_item(cls, category_name, item_name):
-        return Item.query.join(Category). \
+        # The category is found through ix_category_lower_name and the item
+        # through ix_item_category_lower_name. The joined category populates
+        # item.category so templates don't lazy load it.
+        return Item.query.join(Item.category).options(contains_eager(Item.category)). \
             filter(func.lower(Category.name) == func.lower(category_name)). \
             filter(func.lower(Item.name) == func.lower(item_name)).one()
 
+    @classmethod
+    def sort_columns(cls, sort):
+        """
+        Columns an item listing is ordered by, ending with the primary key so
+        the order is total. Every sort is backed by an index declared in
+        __table_args__.
+
+        :param sort: One of SORT_KEYS
+        :return: list of columns
+        """
+        return [getattr(Category, name[len('category.'):]) if name.startswith('category.') else getattr(Item, name)
+                for name in SORT_KEYS[sort]]
+
+    @classmethod
+    def join_sort(cls, query, sort, load_category=False):
+        """
+        Join the category to an item query when the sort needs its columns,
+        loading it into item.category from the same join.
+
+        :param query: Item query
+        :param sort: One of SORT_KEYS
+        :param load_category: Also load the category when the sort does not
+          need it
+        :return: SQLAlchemy query
+        """
+        if any(name.startswith('category.') for name in SORT_KEYS[sort]):
+            return query.join(Item.category).options(contains_eager(Item.category))
+        if load_category:
+            return query.options(joinedload(Item.category))
+        return query
+
+    def sort_values(self, sort):
+        """
+        Values of the sort columns of this item, e.g. for a cursor.
+
+        :param sort: One of SORT_KEYS
+        :return: tuple
+        """
+        return tuple(getattr(self.category, name[len('category.'):]) if name.startswith('category.')
+                     else getattr(self, name) for name in SORT_KEYS[sort])
+
+    @classmethod
+    def order_by_clauses(cls, sort, direction='asc'):
+        columns = cls.sort_columns(sort)
+        return [column.desc() if direction == 'desc' else column.asc() for column in columns]
+
+    @classmethod
+    def keyset_page(cls, per_page, after=None, sort='id', direction='asc', category_ids=None):
+        """
+        Return a query for one page of items using keyset (seek) pagination
+        instead of OFFSET, so every page costs the same regardless of depth.
+
+        One extra row is fetched so the caller can tell whether a next page
+        exists without issuing a COUNT.
+
+        :param per_page: Number of items in the page
+        :param after: Values of the sort columns of the last row of the
+          previous page
+        :type after: tuple
+        :param sort: One of SORT_KEYS
+        :param direction: 'asc' or 'desc'
+        :param category_ids: Optionally restrict items to these categories
+        :return: SQLAlchemy query
+        """
+        query = cls.join_sort(Item.query, sort)
+        if category_ids is not None:
+            query = query.filter(Item.category_id.in_(category_ids))
+
+        if after:
+            query = query.filter(_seek_after(cls.sort_columns(sort), after, direction == 'desc'))
+
+        return query.order_by(*cls.order_by_clauses(sort, direction)).limit(per_page + 1)
+
+    def after_save(self):
+        # The cached categories carry the item counts.
+        category_cache.invalidate()
+        fragment_cache.clear()
+
+    def after_delete(self):
+        category_cache.invalidate()
+        fragment_cache.clear()
+
     @property
     def serialize(self):
-        return {
-            'name': self.name,
-            'description': self.description,
-            'image': self.image,
-            'category_id': self.category_id,
-            'created_on': self.created_on,
-            'updated_on': self.updated_on
-        }
+        return {field: getattr(self, field) for field in ITEM_FIELDS}
+
+
+Index('ix_item_category_lower_name', Item.category_id, func.lower(Item.name))
+
+
+# Arbitrary key of the advisory lock serializing recent items rebuilds.
+RECENT_ITEMS_LOCK = 4207
+
+
+class RecentItem(db.Model):
+    """
+    The RECENT_ITEMS_SIZE most recently updated items, so the first pages of
+    the front page don't sort the item table. Rebuilt from ix_item_updated_on
+    whenever items change, see _maintain_catalog_stats.
+    """
+    item_id = db.Column(db.Integer, db.ForeignKey(Item.id, ondelete="CASCADE"), primary_key=True)
+    updated_on = db.Column(db.DateTime())
 
+    __table_args__ = (Index('ix_recent_item_updated_on', 'updated_on', 'item_id'),)
+
+    @classmethod
+    def covers(cls, page, per_page):
+        return page * per_page <= current_app.config['RECENT_ITEMS_SIZE']
+
+
+def refresh_item_counts(connection, category_ids=None):
+    """
+    Recount the items of every category, or of some.
+
+    :param connection: Connection or session to execute on
+    :param category_ids: Only recount these categories
+    :return: None
+    """
+    table = Category.__table__
+    count = select([func.count(Item.__table__.c.id)]).where(Item.__table__.c.category_id == table.c.id).as_scalar()
+    # Counts are not edits: keep updated_on rather than apply its onupdate.
+    statement = table.update().values(item_count=count, updated_on=table.c.updated_on)
+    if category_ids is not None:
+        statement = statement.where(table.c.id.in_(category_ids))
+    connection.execute(statement)
+    return None
+
+
+def refresh_recent_items(connection):
+    """
+    Rebuild the recent items list from the item table.
+
+    :param connection: Connection or session to execute on
+    :return: None
+    """
+    items = Item.__table__
+    if db.engine.dialect.name == 'postgresql':
+        # Concurrent rebuilds would insert the same rows twice.
+        connection.execute(select([func.pg_advisory_xact_lock(RECENT_ITEMS_LOCK)]))
+    connection.execute(RecentItem.__table__.delete())
+    latest = select([items.c.id, items.c.updated_on]) \
+        .order_by(items.c.updated_on.desc(), items.c.id.desc()) \
+        .limit(current_app.config['RECENT_ITEMS_SIZE'])
+    connection.execute(RecentItem.__table__.insert().from_select(['item_id', 'updated_on'], latest))
+    return None
+
+
+def refresh_catalog_stats(connection):
+    """
+    Recompute the item counts and the recent items list, after writing items
+    with Core statements that bypass the session events.
+
+    :param connection: Connection or session to execute on
+    :return: None
+    """
+    refresh_item_counts(connection)
+    refresh_recent_items(connection)
+    return None
+
+
+@event.listens_for(db.session, 'before_flush')
+def _remember_deleted_items(session, flush_context, instances):
+    # Deleted rows can't be loaded after the flush.
+    for instance in session.deleted:
+        if isinstance(instance, Item):
+            session.info.setdefault('deleted_item_categories', []).append(instance.category_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_deleted_items(session):
+    session.info.pop('deleted_item_categories', None)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _maintain_catalog_stats(session, flush_context):
+    """
+    Apply the item count changes of a flush to the categories and rebuild
+    the recent items list if any item changed, in the flush's transaction.
+    """
+    deltas = Counter()
+    for category_id in session.info.pop('deleted_item_categories', []):
+        deltas[category_id] -= 1
+
+    items_changed = bool(deltas)
+    for instance in session.new:
+        if isinstance(instance, Item):
+            deltas[instance.category_id] += 1
+            items_changed = True
+
+    recount = False
+    for instance in session.dirty:
+        if isinstance(instance, Item) and session.is_modified(instance):
+            items_changed = True
+            history = inspect(instance).attrs.category_id.history
+            if history.added and not history.deleted:
+                # Moved without the previous category being loaded.
+                recount = True
+            for category_id in history.deleted:
+                deltas[category_id] -= 1
+            for category_id in history.added:
+                deltas[category_id] += 1
+
+    # Deleted categories take their items with them.
+    items_changed = items_changed or any(isinstance(instance, Category) for instance in session.deleted)
+
+    updates = [{'_id': category_id, 'delta': delta} for category_id, delta in deltas.items()
+               if category_id is not None and delta]
+    if recount:
+        refresh_item_counts(session)
+    elif updates:
+        table = Category.__table__
+        session.execute(table.update().where(table.c.id == bindparam('_id'))
+                        .values(item_count=table.c.item_count + bindparam('delta'), updated_on=table.c.updated_on),
+                        updates)
+    if items_changed:
+        refresh_recent_items(session)
+
+
+class Change(db.Model):
+    """
+    Log of every insert, update and delete of items and categories, written
+    by database triggers whichever code path issues them, see
+    app.blueprints.catalog.changes. The id is the position of a change in
+    the feed.
+    """
+    __tablename__ = 'change_log'
+
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(16), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(8), nullable=False)
+    changed_on = db.Column(db.DateTime(), nullable=False)
 
+    # Never reuse the ids of pruned changes on SQLite, clients hold them.
+    __table_args__ = (Index('ix_change_log_changed_on', 'changed_on'),
+                      # Latest change of an entity, see category_version.
+                      Index('ix_change_log_entity', 'entity', 'id'),
+                      {'sqlite_autoincrement': True})
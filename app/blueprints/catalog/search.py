@@ -0,0 +1,143 @@
+import re
+
+from sqlalchemy import event, DDL, text
+from sqlalchemy.orm import joinedload
+
+from app.blueprints.catalog.models import Item
+from app.extensions import db
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SQLiteSearchBackend(object):
+    """
+    Full text search using an external content FTS5 table. Triggers keep the
+    index in step with every insert, update and delete on the item table,
+    whichever code path issues them.
+    """
+    dialect = 'sqlite'
+
+    ddl = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS item_search USING fts5("
+        "name, description, content='item', content_rowid='id')",
+        "CREATE TRIGGER IF NOT EXISTS item_search_ai AFTER INSERT ON item BEGIN "
+        "INSERT INTO item_search(rowid, name, description) VALUES (new.id, new.name, new.description); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS item_search_ad AFTER DELETE ON item BEGIN "
+        "INSERT INTO item_search(item_search, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS item_search_au AFTER UPDATE OF name, description ON item BEGIN "
+        "INSERT INTO item_search(item_search, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); "
+        "INSERT INTO item_search(rowid, name, description) VALUES (new.id, new.name, new.description); "
+        "END"
+    ]
+    drop_ddl = ["DROP TABLE IF EXISTS item_search"]
+    rebuild_sql = "INSERT INTO item_search(item_search) VALUES ('rebuild')"
+
+    search_sql = text("SELECT rowid FROM item_search WHERE item_search MATCH :query "
+                      "ORDER BY bm25(item_search), rowid LIMIT :limit OFFSET :offset")
+
+    @staticmethod
+    def make_query(q):
+        # Quote every token so user input can't inject FTS5 syntax, and let the
+        # last one match as a prefix for search-as-you-type.
+        tokens = TOKEN_RE.findall(q)
+        if not tokens:
+            return None
+        quoted = ['"{0}"'.format(token) for token in tokens]
+        quoted[-1] += '*'
+        return ' '.join(quoted)
+
+
+class PostgresSearchBackend(object):
+    """
+    Full text search using a GIN index over the tsvector expression of name
+    and description. PostgreSQL maintains expression indexes itself on every
+    write, so no extra column or trigger is needed.
+    """
+    dialect = 'postgresql'
+
+    document = "to_tsvector('english', coalesce(name, '') || ' ' || coalesce(description, ''))"
+
+    ddl = ["CREATE INDEX IF NOT EXISTS ix_item_search ON item USING GIN ({0})".format(document)]
+    drop_ddl = ["DROP INDEX IF EXISTS ix_item_search"]
+    rebuild_sql = "REINDEX INDEX ix_item_search"
+
+    search_sql = text("SELECT id FROM item, plainto_tsquery('english', :query) query "
+                      "WHERE {0} @@ query "
+                      "ORDER BY ts_rank({0}, query) DESC, id LIMIT :limit OFFSET :offset".format(document))
+
+    @staticmethod
+    def make_query(q):
+        q = q.strip()
+        return q or None
+
+
+BACKENDS = {backend.dialect: backend for backend in (SQLiteSearchBackend, PostgresSearchBackend)}
+
+for _backend in BACKENDS.values():
+    for _statement in _backend.ddl:
+        event.listen(Item.__table__, 'after_create', DDL(_statement).execute_if(dialect=_backend.dialect))
+    for _statement in _backend.drop_ddl:
+        event.listen(Item.__table__, 'before_drop', DDL(_statement).execute_if(dialect=_backend.dialect))
+
+
+def get_backend():
+    return BACKENDS.get(db.engine.dialect.name)
+
+
+def rebuild_index():
+    """
+    Create the search index of an existing database if needed and rebuild it
+    from the item table.
+
+    :return: None
+    """
+    backend = get_backend()
+    if backend is None:
+        return None
+
+    with db.engine.begin() as connection:
+        for statement in backend.ddl:
+            connection.execute(text(statement))
+        connection.execute(text(backend.rebuild_sql))
+    return None
+
+
+def search_items(q, page, per_page):
+    """
+    Search items by name and description, best matches first.
+
+    One row more than the page size is fetched to tell whether a next page
+    exists without counting every match.
+
+    :param q: Query as typed by the user
+    :param page: 1 based page number
+    :param per_page: Items per page
+    :return: tuple of (list of Item, has_next)
+    """
+    backend = get_backend()
+    offset = (page - 1) * per_page
+
+    if backend is None:
+        pattern = '%{0}%'.format(q.strip())
+        items = Item.query.options(joinedload(Item.category)) \
+            .filter(Item.name.ilike(pattern) | Item.description.ilike(pattern)) \
+            .order_by(Item.name, Item.id).limit(per_page + 1).offset(offset).all()
+        return items[:per_page], len(items) > per_page
+
+    query = backend.make_query(q)
+    if query is None:
+        return [], False
+
+    ids = [row[0] for row in db.session.execute(backend.search_sql,
+                                                {'query': query, 'limit': per_page + 1, 'offset': offset})]
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    if not ids:
+        return [], has_next
+
+    by_id = {item.id: item for item in Item.query.options(joinedload(Item.category)).filter(Item.id.in_(ids))}
+    return [by_id[item_id] for item_id in ids if item_id in by_id], has_next
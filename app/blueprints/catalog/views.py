@@ -1,23 +1,41 @@
+import functools
+import logging
 import os
-import time
 
 import bleach
-from flask import Blueprint, render_template, flash, redirect, url_for, request, current_app, send_from_directory, \
-    jsonify
+from flask import Blueprint, render_template, flash, redirect, url_for, request, current_app, send_file, \
+    jsonify, abort, json, Response, stream_with_context
 from flask_breadcrumbs import register_breadcrumb, default_breadcrumb_root
 from flask_login import login_required, current_user
 from markupsafe import Markup
-from werkzeug.utils import secure_filename
-
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import NoResultFound
+
+from app.blueprints.catalog.batch import ItemBatch
+from app.blueprints.catalog.changes import latest_change_id, is_pruned, wait_for_changes, serialize_changes, \
+    iter_events
+from app.blueprints.catalog.exporter import export_rows, iter_gzip, FORMATTERS
 from app.blueprints.catalog.forms import ItemForm, UploadForm
-from app.blueprints.catalog.models import Category, Item
-from app.extensions import csrf
+from app.blueprints.catalog.importer import parse_date, CatalogImportError
+from app.blueprints.catalog.models import Category, Item, RecentItem, catalog_validators, SORT_KEYS
+from app.blueprints.catalog.search import search_items
+from app.extensions import csrf, fragment_cache, image_pipeline, upload_store
+from app.lib.database import use_replica
+from app.lib.util_conditional import conditional
+from app.lib.util_pagination import encode_cursor, decode_cursor, InvalidCursor, paginate, UncountedPagination
+from app.lib.util_sqlalchemy import query_budget
 from app.mixins.util_wtforms import choices_from_dict
 from config.settings import ITEMS_PER_PAGE
 
+logger = logging.getLogger(__name__)
+
 catalog = Blueprint('catalog', __name__, template_folder='templates')
 default_breadcrumb_root(catalog, '.')
 
+# Sorts offered on the HTML item listings.
+LISTING_SORTS = ('name', 'created_on', 'updated_on', 'category')
+
 
 # noinspection PyUnusedLocal
 def view_catalog_dlc(*args, **kwargs):
@@ -63,14 +81,35 @@ def delete_item_dlc(*args, **kwargs):
 @catalog.route('/catalog/<string:category>/items', methods=['GET', 'POST'])
 @catalog.route('/catalog/<string:category>/items/<int:page>', methods=['GET', 'POST'])
 @register_breadcrumb(catalog, '.', 'Home', dynamic_list_constructor=view_catalog_dlc)
+@use_replica
+@conditional(catalog_validators)
+@fragment_cache.cached()
+@query_budget(4)
 def home(category=None, page=1):
+    # Budget: sidebar categories, items page and the Flask-Login user lookup
+    # for authenticated requests. Totals come from the maintained item
+    # counts, read live with the sidebar rather than from the per process
+    # category cache, instead of a COUNT.
     selected_category = None
-    categories = Category.query.all()
-    if not category:
-        items = Item.query.order_by(Item.updated_on.desc()).paginate(page, ITEMS_PER_PAGE, True)
+    categories = Category.get_summaries()
+    sort, direction = listing_sort('updated_on' if not category else 'created_on')
+    query = Item.join_sort(Item.query, sort, load_category=True)
+    if category:
+        selected_category = next((c for c in categories if c.name.lower() == category.lower()), None)
+        if selected_category is None:
+            abort(404)
+        query = query.filter(Item.category_id == selected_category.id)
+        total = selected_category.item_count
     else:
-        selected_category = Category.category_details(category)
-        items = selected_category.get_items().order_by(Item.created_on.desc()).paginate(page, ITEMS_PER_PAGE, True)
+        total = sum(c.item_count or 0 for c in categories)
+
+    if not category and (sort, direction) == ('updated_on', 'desc') and RecentItem.covers(page, ITEMS_PER_PAGE):
+        query = query.join(RecentItem, RecentItem.item_id == Item.id) \
+            .order_by(RecentItem.updated_on.desc(), RecentItem.item_id.desc())
+    else:
+        query = query.order_by(*Item.order_by_clauses(sort, direction))
+
+    items = paginate(query, page, ITEMS_PER_PAGE, True, total=total)
 
     return render_template('catalog/home.html',
                            categories=categories,
@@ -78,8 +117,47 @@ def home(category=None, page=1):
                            selected_category=selected_category)
 
 
+def listing_sort(default_sort):
+    """
+    Read the sort and direction query arguments of an item listing, as
+    generated by the sort macro, ignoring anything not whitelisted.
+
+    :param default_sort: Sort used when none or an unknown one is requested
+    :return: tuple of (sort, direction)
+    """
+    sort = request.args.get('sort')
+    if sort not in LISTING_SORTS:
+        return default_sort, 'desc'
+
+    direction = request.args.get('direction', 'asc')
+    if direction not in ('asc', 'desc'):
+        direction = 'asc'
+    return sort, direction
+
+
+@catalog.route('/catalog/search')
+@register_breadcrumb(catalog, '.search', 'Search')
+@use_replica
+@conditional(catalog_validators)
+@fragment_cache.cached()
+def search():
+    q = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        abort(404)
+
+    items, has_next = search_items(q, page, ITEMS_PER_PAGE) if q.strip() else ([], False)
+    return render_template('catalog/search.html',
+                           q=q,
+                           categories=Category.get_summaries(),
+                           items=UncountedPagination(None, page, ITEMS_PER_PAGE, items, has_next))
+
+
 @catalog.route('/catalog/<string:category>/items/<string:item>')
 @register_breadcrumb(catalog, '.item', '', dynamic_list_constructor=view_item_dlc)
+@use_replica
+@conditional(catalog_validators)
+@fragment_cache.cached()
 def item_in_category(category, item):
     selected_item = Item.get_item(category, item)
     return render_template('catalog/item_details.html', item=selected_item)
@@ -100,7 +178,7 @@ def add_item():
         form.name = bleach.clean(form.name)
         form.populate_obj(item)
         item.created_by = current_user.username
-        print(f"Creating item ${item}")
+        logger.debug('Creating item %s', item)
         item.save()
         flash("Item Created Successfully", "success")
         return redirect(url_for('catalog.edit_item', category=item.category.name, item=item.name))
@@ -121,12 +199,12 @@ def edit_item(category, item):
     form = ItemForm(obj=selected_item)
     form.category_id.choices = choices_from_dict(Category.get_categories_as_dict())
     if form.validate_on_submit():
-        print(f"Item current state ${selected_item}")
+        logger.debug('Item current state %s', selected_item)
         selected_item.description = bleach.clean(form.description.data)
         selected_item.name = bleach.clean(form.name.data)
         selected_item.category_id = form.category_id.data
         selected_item.save()
-        print(f"Updated item state ${selected_item}")
+        logger.debug('Updated item state %s', selected_item)
         flash("Item Updated Successfully", "success")
         return redirect(url_for('catalog.edit_item', category=selected_item.category.name, item=selected_item.name))
 
@@ -141,7 +219,6 @@ def edit_item(category, item):
 @csrf.exempt
 @login_required
 def upload_image(category, item):
-    print("In upload image")
     selected_item = Item.get_item(category, item)
 
     authorized = check_authorization(selected_item)
@@ -150,22 +227,22 @@ def upload_image(category, item):
         return redirect(url_for('catalog.item_in_category', category=category, item=item))
 
     form = UploadForm()
-    print(form.image.data)
 
     if request.method == "POST":
         f = form.image.data
-        ext = os.path.splitext(secure_filename(f.filename))[1]
-        filename = secure_filename(f"{category}_{selected_item.id}_{time.time()}{ext}")
-        print(f"Filename is {filename}")
-        path = os.path.join(
-            current_app.instance_path, 'uploads', filename
-        )
-        print(f"Saving file to {path}")
-        f.save(os.path.join(
-            current_app.instance_path, 'uploads', filename
-        ))
-        selected_item.image = f'/uploads/{filename}'
+        if not f:
+            flash("Please select an image to upload.", "error")
+            return redirect(url_for('catalog.upload_image', category=category, item=item))
+        key = upload_store.save(f, max_size=current_app.config['UPLOAD_MAX_SIZE'],
+                                allowed_types=current_app.config['UPLOAD_ALLOWED_TYPES'])
+        path = upload_store.path(key)
+        logger.info('Saved upload for item %s to %s', selected_item.id, path)
+        selected_item.image = f'/uploads/{key}'
+        selected_item.thumbnail = None
+        selected_item.web_image = None
         selected_item.save()
+        image_pipeline.submit(path, functools.partial(record_image_variants, selected_item.id, selected_item.image),
+                              root=upload_store.root)
         flash("File Uploaded", "success")
         return redirect(url_for('catalog.upload_image', category=category, item=item))
     return render_template('catalog/upload_image.html',
@@ -206,13 +283,30 @@ def delete_item(category, item):
         return render_template('catalog/item_details.html', item=selected_item)
 
 
-@catalog.route('/uploads/<filename>')
+@catalog.route('/uploads/<path:filename>')
+@use_replica
 def uploaded_file(filename):
-    return send_from_directory(f'{current_app.instance_path}/uploads',
-                               filename)
+    path = upload_store.path(filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    # Content addressed files (ab/cd/<sha256>.ext) never change.
+    immutable = '/' in filename
+    max_age = current_app.config['UPLOAD_CACHE_MAX_AGE'] if immutable else None
+    response = send_file(path, conditional=False, cache_timeout=max_age)
+
+    # Let the front server handle ranges when it sends the file itself.
+    use_ranges = not current_app.use_x_sendfile
+    response = response.make_conditional(request.environ, accept_ranges=use_ranges,
+                                         complete_length=os.path.getsize(path))
+    if immutable:
+        response.headers['Cache-Control'] = f'public, max-age={max_age}, immutable'
+    return response
 
 
 @catalog.route('/api/v1/catalog')
+@use_replica
+@conditional(catalog_validators)
 def catalog_as_json():
     categories = Category.query.all()
     result = {
@@ -221,6 +315,250 @@ def catalog_as_json():
     return jsonify(result)
 
 
+@catalog.route('/api/v1/catalog/<string:category>/items/<string:item>')
+@use_replica
+def item_as_json(category, item):
+    try:
+        selected_item = Item.get_item(category, item)
+    except NoResultFound:
+        abort(404)
+    return jsonify(selected_item.serialize)
+
+
+@catalog.route('/api/v2/catalog')
+@use_replica
+@conditional(catalog_validators)
+def catalog_as_json_v2():
+    """
+    Stream one page of the catalog as JSON.
+
+    Categories and items are fetched with one query each and written out
+    incrementally, so memory use is bounded by the page size rather than by
+    the size of the catalog.
+
+    Query arguments:
+      category: Restrict the page to one or more categories (repeatable)
+      order: 'id' (default), 'name', 'created_on', 'updated_on' or 'category'
+        (category name, then creation date)
+      direction: 'asc' (default) or 'desc'
+      limit: Number of items per page
+      cursor: The next_cursor value returned by the previous page
+    """
+    order_by = request.args.get('order', 'id')
+    direction = request.args.get('direction', 'asc')
+    if order_by not in SORT_KEYS or direction not in ('asc', 'desc'):
+        abort(400)
+
+    limit = request.args.get('limit', current_app.config['API_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['API_MAX_PAGE_SIZE']))
+
+    key_types = [column.type.python_type for column in Item.sort_columns(order_by)]
+    after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after = decode_cursor(cursor, *key_types)
+        except InvalidCursor:
+            abort(400)
+
+    categories_query = Category.query.order_by(Category.id)
+    category_names = request.args.getlist('category')
+    category_ids = None
+    if category_names:
+        categories_query = categories_query.filter(
+            func.lower(Category.name).in_([name.lower() for name in category_names]))
+        categories = categories_query.all()
+        category_ids = [category.id for category in categories]
+    else:
+        categories = categories_query.all()
+
+    items = Item.keyset_page(limit, after=after, sort=order_by, direction=direction, category_ids=category_ids) \
+        .execution_options(stream_results=True) \
+        .yield_per(100)
+
+    def generate():
+        yield '{"categories": ['
+        for index, category in enumerate(categories):
+            yield (',' if index else '') + json.dumps(category.serialize_summary)
+
+        yield '], "items": ['
+        next_cursor = None
+        last = None
+        for index, item in enumerate(items):
+            if index == limit:
+                next_cursor = encode_cursor(*last.sort_values(order_by))
+                break
+            yield (',' if index else '') + json.dumps(item.serialize)
+            last = item
+
+        yield '], "next_cursor": {}}}'.format(json.dumps(next_cursor))
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+@catalog.route('/api/v1/search')
+@use_replica
+def search_as_json():
+    q = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('limit', ITEMS_PER_PAGE, type=int)
+    per_page = max(1, min(per_page, current_app.config['API_MAX_PAGE_SIZE']))
+    if page < 1 or not q.strip():
+        abort(400)
+
+    items, has_next = search_items(q, page, per_page)
+    return jsonify({
+        'items': [item.serialize for item in items],
+        'page': page,
+        'has_next': has_next
+    })
+
+
+@catalog.route('/api/v1/changes')
+@use_replica
+def changes():
+    """
+    Feed of the item and category inserts, updates and deletes, oldest
+    first, for clients keeping a copy of the catalog in step.
+
+    Without a cursor the response only holds the position of the latest
+    change: take it, download the catalog, then follow the changes from it.
+    Every change carries the current state of its row, null once deleted,
+    so changes replayed twice are harmless.
+
+    Query arguments:
+      since: The next_cursor value returned by the previous response
+      limit: Most changes per response
+      wait: Seconds to wait for a change when there are none yet, up to
+        CHANGES_MAX_WAIT (long polling)
+
+    Clients accepting text/event-stream get the changes as server-sent
+    events instead, starting after since or the Last-Event-ID header.
+
+    A 410 means changes following the cursor were pruned from the log and
+    the catalog has to be downloaded again.
+    """
+    limit = request.args.get('limit', current_app.config['API_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['API_MAX_PAGE_SIZE']))
+    interval = current_app.config['CHANGES_POLL_INTERVAL']
+
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('since')
+    if cursor:
+        try:
+            after, = decode_cursor(cursor, int)
+        except InvalidCursor:
+            abort(400)
+        if is_pruned(after):
+            abort(410)
+    else:
+        after = latest_change_id()
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        events = iter_events(after, limit, interval, current_app.config['CHANGES_STREAM_TIMEOUT'])
+        return Response(stream_with_context(events), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+
+    if not cursor:
+        return jsonify({'changes': [], 'next_cursor': encode_cursor(after)})
+
+    wait = request.args.get('wait', 0, type=float)
+    wait = max(0, min(wait, current_app.config['CHANGES_MAX_WAIT']))
+    page = wait_for_changes(after, limit, wait, interval)
+    return jsonify({
+        'changes': serialize_changes(page),
+        'next_cursor': encode_cursor(page[-1].id if page else after)
+    })
+
+
+@catalog.route('/api/v1/export')
+@login_required
+def export():
+    """
+    Stream the items of the catalog as JSON Lines or CSV, gzip compressed
+    when the client accepts it.
+
+    Query arguments:
+      format: 'jsonl' (default) or 'csv'
+      category: Restrict the export to one or more categories (repeatable)
+      updated_since, updated_until: Only items updated in this range, for
+        incremental exports (ISO 8601)
+    """
+    file_format = request.args.get('format', 'jsonl')
+    if file_format not in FORMATTERS:
+        abort(400)
+    try:
+        updated_since = parse_date(request.args.get('updated_since') or None)
+        updated_until = parse_date(request.args.get('updated_until') or None)
+    except CatalogImportError:
+        abort(400)
+
+    formatter, mimetype = FORMATTERS[file_format]
+    chunks = formatter(export_rows(request.args.getlist('category'), updated_since, updated_until))
+    headers = {'Content-Disposition': f'attachment; filename=catalog.{file_format}'}
+    if 'gzip' in request.accept_encodings:
+        chunks = iter_gzip(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    headers['Vary'] = 'Accept-Encoding'
+
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+
+@catalog.route('/api/v1/items/batch', methods=['POST'])
+@csrf.exempt
+@login_required
+def items_batch():
+    """
+    Create, update and delete up to API_BATCH_MAX_ITEMS items in one
+    transaction, see ItemBatch for the operations.
+
+    The body is a JSON object {"items": [operation, ...]}. The response lists
+    one result per operation, in order, with the id of the item. If any
+    operation is invalid nothing is written, the response is a 422 and the
+    invalid operations carry their errors.
+    """
+    # Only JSON bodies are accepted, which cross site forms can't send, so
+    # the CSRF token is not required.
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('items'), list):
+        abort(400)
+    if len(payload['items']) > current_app.config['API_BATCH_MAX_ITEMS']:
+        abort(413)
+
+    batch = ItemBatch(payload['items'], current_user.username)
+    if not batch.validate():
+        return jsonify({'applied': False, 'results': batch.results}), 422
+
+    try:
+        results = batch.apply()
+    except IntegrityError:
+        # Lost a race with a concurrent write of the same names.
+        logger.warning('Batch of %d items conflicted with a concurrent write', len(payload['items']))
+        return jsonify({'applied': False, 'results': batch.results}), 409
+
+    logger.info('Applied a batch of %d items for %s', len(results), current_user.username)
+    return jsonify({'applied': True, 'results': results})
+
+
+def record_image_variants(item_id, image, variants):
+    """
+    Store the resized variants of an uploaded image on its item, unless the
+    item was deleted or given another image in the meantime.
+
+    :param item_id: Id of the item the image was uploaded for
+    :param image: Url of the uploaded image
+    :param variants: Keys of the variants in the upload store by name
+    :return: None
+    """
+    selected_item = Item.query.get(item_id)
+    if selected_item is None or selected_item.image != image:
+        return None
+
+    selected_item.thumbnail = f"/uploads/{variants['thumbnail']}" if 'thumbnail' in variants else None
+    selected_item.web_image = f"/uploads/{variants['web']}" if 'web' in variants else None
+    selected_item.save()
+    return None
+
+
 def check_authorization(item):
     logged_in_user = current_user.username
     if item.created_by == logged_in_user:
@@ -1,14 +1,80 @@
+import threading
+import time
+
+from flask import current_app
 from flask_dance.consumer.backend.sqla import OAuthConsumerMixin
 from flask_login import UserMixin
 
 from app.extensions import db
+from app.lib.database import read_from_primary
 from app.mixins.sqlalchemy_resource_mixin import ResourceMixin
 
 
+class UserCache(object):
+    """
+    Process local cache of the users loaded by Flask-Login on every
+    authenticated request. Users are kept detached for USER_CACHE_TTL
+    seconds, or until saved or deleted in this process, and merged into the
+    session of each request without a query.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """
+        Return the user with this id attached to the current session.
+
+        :param user_id: User id
+        :return: User or None
+        """
+        ttl = current_app.config.get('USER_CACHE_TTL', 60)
+        entry = self._users.get(user_id)
+        if entry is not None and time.time() < entry[0]:
+            self.hits += 1
+            return db.session.merge(entry[1], load=False)
+
+        self.misses += 1
+        # Cached for every later request: never a replica's stale copy.
+        with read_from_primary():
+            user = User.query.get(user_id)
+        if user is None or not ttl:
+            return user
+
+        # Keep a detached copy: the cached instance is shared by threads and
+        # must never belong to a request's session.
+        db.session.expunge(user)
+        with self._lock:
+            self._users[user_id] = (time.time() + ttl, user)
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_id, None)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+user_cache = UserCache()
+
+
 class User(db.Model, ResourceMixin, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(256), unique=True)
 
+    def after_save(self):
+        user_cache.invalidate(self.id)
+
+    def after_delete(self):
+        user_cache.invalidate(self.id)
+
 
 class OAuth(OAuthConsumerMixin, db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey(User.id))
@@ -1,9 +1,20 @@
 from flask_debugtoolbar import DebugToolbarExtension
 from flask_wtf import CsrfProtect
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 
+from app.lib.assets import AssetPipeline
+from app.lib.cache import FragmentCache
+from app.lib.database import SQLAlchemy
+from app.lib.images import ImagePipeline
+from app.lib.metrics import Metrics
+from app.lib.storage import ContentStore
+
 debug_toolbar = DebugToolbarExtension()
 csrf = CsrfProtect()
 db = SQLAlchemy()
 login_manager = LoginManager()
+fragment_cache = FragmentCache()
+image_pipeline = ImagePipeline()
+upload_store = ContentStore()
+assets = AssetPipeline()
+metrics = Metrics()
@@ -0,0 +1,188 @@
+import asyncio
+import itertools
+import re
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine.url import make_url
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+# Positional placeholders, and escaped percent signs, of the 'format'
+# paramstyle.
+FORMAT_PARAM_RE = re.compile(r'%([s%])')
+
+
+class PostgresPool(object):
+    """
+    asyncpg connection pool. asyncpg also caches the prepared statement of
+    every query on each connection.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    @classmethod
+    async def create(cls, url, config):
+        if asyncpg is None:
+            raise RuntimeError("asyncpg is required to serve PostgreSQL databases asynchronously")
+
+        server_settings = {}
+        if config['DATABASE_STATEMENT_TIMEOUT']:
+            server_settings['statement_timeout'] = str(int(config['DATABASE_STATEMENT_TIMEOUT']))
+        pool = await asyncpg.create_pool(
+            host=url.host, port=url.port, user=url.username, password=url.password, database=url.database,
+            min_size=config['SQLALCHEMY_POOL_SIZE'] or 1,
+            max_size=(config['SQLALCHEMY_POOL_SIZE'] or 1) + (config['SQLALCHEMY_MAX_OVERFLOW'] or 0),
+            max_inactive_connection_lifetime=config['SQLALCHEMY_POOL_RECYCLE'] or 0,
+            server_settings=server_settings)
+        return cls(pool)
+
+    async def fetch(self, sql, params):
+        async with self._pool.acquire() as connection:
+            return await connection.fetch(sql, *params)
+
+    async def close(self):
+        await self._pool.close()
+
+
+class SQLitePool(object):
+    """
+    Fixed set of aiosqlite connections handed out in turn. SQLite has no
+    asynchronous I/O: aiosqlite runs every connection in a thread of its
+    own, so the pool size bounds the concurrent queries.
+    """
+
+    def __init__(self, connections):
+        self._connections = connections
+        self._idle = asyncio.Queue()
+        for connection in connections:
+            self._idle.put_nowait(connection)
+
+    @classmethod
+    async def create(cls, url, config):
+        if aiosqlite is None:
+            raise RuntimeError("aiosqlite is required to serve SQLite databases asynchronously")
+
+        connections = []
+        for _ in range(config['SQLALCHEMY_POOL_SIZE'] or 1):
+            # Opened like "async with aiosqlite.connect(...)", which starts
+            # the connection's thread, but closed by close().
+            connection = aiosqlite.connect(url.database)
+            await connection.__aenter__()
+            connections.append(connection)
+            for name, value in config['SQLITE_PRAGMAS'].items():
+                async with connection.execute(f'PRAGMA {name} = {value}'):
+                    pass
+        return cls(connections)
+
+    async def fetch(self, sql, params):
+        connection = await self._idle.get()
+        try:
+            async with connection.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+        finally:
+            self._idle.put_nowait(connection)
+
+    async def close(self):
+        for connection in self._connections:
+            await connection.close()
+
+
+POOLS = {
+    'postgresql': (PostgresPool, postgresql.dialect(paramstyle='format')),
+    'sqlite': (SQLitePool, sqlite.dialect())
+}
+
+
+class AsyncDatabase(object):
+    """
+    Run SQLAlchemy Core queries, built from the models' tables, on the
+    connection pool of an asyncio driver: asyncpg for PostgreSQL and
+    aiosqlite for SQLite. SQLAlchemy only compiles the queries.
+
+    The pool is configured with the settings of the Flask app: the
+    DATABASE_REPLICA_BIND database when set, as only reads are made, or
+    SQLALCHEMY_DATABASE_URI, SQLALCHEMY_POOL_SIZE plus
+    SQLALCHEMY_MAX_OVERFLOW connections, DATABASE_STATEMENT_TIMEOUT and
+    SQLITE_PRAGMAS.
+
+    Example:
+      database = await AsyncDatabase.connect(app.config)
+      rows = await database.fetch(select([Item.__table__]).limit(10))
+    """
+
+    def __init__(self, pool, dialect):
+        self.pool = pool
+        self.dialect = dialect
+
+    @classmethod
+    async def connect(cls, config):
+        """
+        Open the connection pool.
+
+        :param config: Flask app config
+        :return: AsyncDatabase
+        """
+        uri = config['SQLALCHEMY_DATABASE_URI']
+        if config.get('DATABASE_REPLICA_BIND'):
+            uri = config['SQLALCHEMY_BINDS'][config['DATABASE_REPLICA_BIND']]
+        url = make_url(uri)
+
+        backend = url.get_backend_name()
+        if backend not in POOLS:
+            raise ValueError(f"No asyncio driver for {backend} databases")
+        pool_class, dialect = POOLS[backend]
+        return cls(await pool_class.create(url, config), dialect)
+
+    def compile(self, query):
+        """
+        Compile a query to the SQL and positional parameters of the driver.
+
+        :return: tuple of (sql, list of parameters)
+        """
+        compiled = query.compile(dialect=self.dialect)
+        params = []
+        for name in compiled.positiontup:
+            # Converted like SQLAlchemy's own executions, e.g. datetimes to
+            # the strings SQLite stores.
+            value = compiled.params[name]
+            processor = compiled.binds[name].type.dialect_impl(self.dialect).bind_processor(self.dialect)
+            params.append(processor(value) if processor else value)
+        sql = compiled.string
+        if self.dialect.paramstyle == 'format':
+            # asyncpg numbers its placeholders: $1, $2...
+            numbers = itertools.count(1)
+            sql = FORMAT_PARAM_RE.sub(lambda match: f'${next(numbers)}' if match.group(1) == 's' else '%', sql)
+        return sql, params
+
+    async def fetch(self, query):
+        """
+        Execute a query and return its rows, as dicts keyed by column when
+        the query is a select, converted like SQLAlchemy's own results.
+
+        :param query: Select or text clause
+        :return: list of dicts or tuples
+        """
+        sql, params = self.compile(query)
+        rows = await self.pool.fetch(sql, params)
+
+        columns = getattr(query, 'c', None)
+        if columns is None:
+            return [tuple(row) for row in rows]
+
+        keys = [column.key for column in columns]
+        processors = [column.type.dialect_impl(self.dialect).result_processor(self.dialect, None)
+                      for column in columns]
+        return [{key: processor(value) if processor else value
+                 for key, processor, value in zip(keys, processors, row)} for row in rows]
+
+    async def close(self):
+        await self.pool.close()
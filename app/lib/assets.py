@@ -0,0 +1,203 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+from flask import request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST_NAME = 'manifest.json'
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.ttf', '.otf', '.eot')
+
+FINGERPRINT_RE = re.compile(r'\.[0-9a-f]{12}(\.[^./]+)(\.gz|\.br)?$')
+
+CSS_URL_RE = re.compile(r'''url\((['"]?)([^'")]+)\1\)''')
+
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _fingerprint(path, content):
+    stem, ext = posixpath.splitext(path)
+    return f'{stem}.{hashlib.sha1(content).hexdigest()[:12]}{ext}'
+
+
+def _rewrite_css_urls(css, source, target, files):
+    """
+    Rewrite the relative url()s of a stylesheet moved from source to target
+    so they still resolve, pointing at fingerprinted files where known.
+    """
+
+    def replace(match):
+        quote, url = match.groups()
+        if url.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        resolved = posixpath.normpath(posixpath.join(posixpath.dirname(source), path))
+        resolved = files.get(resolved, resolved)
+        relative = posixpath.relpath(resolved, posixpath.dirname(target) or '.')
+        return f'url({quote}{relative}{suffix}{quote})'
+
+    return CSS_URL_RE.sub(replace, css)
+
+
+def _write(static_folder, path, content):
+    full_path = os.path.join(static_folder, path)
+    with open(full_path, 'wb') as output:
+        output.write(content)
+
+    if path.endswith(COMPRESSIBLE_EXTENSIONS):
+        with open(full_path + '.gz', 'wb') as output:
+            output.write(gzip.compress(content, 9))
+        if brotli is not None:
+            with open(full_path + '.br', 'wb') as output:
+                output.write(brotli.compress(content))
+
+
+def clean(static_folder):
+    """
+    Delete the files written by build.
+
+    :param static_folder: The app's static folder
+    :return: None
+    """
+    for directory, _, names in os.walk(static_folder):
+        for name in names:
+            if FINGERPRINT_RE.search(name) or name == MANIFEST_NAME:
+                os.remove(os.path.join(directory, name))
+    return None
+
+
+def build(static_folder, bundles):
+    """
+    Write a fingerprinted copy, named after a hash of its content, of every
+    static file and bundle, with gzip (and brotli when installed) variants of
+    the text files, plus a manifest mapping original names to fingerprinted
+    ones.
+
+    Stylesheets are processed last so their url()s can point at the
+    fingerprinted fonts and images.
+
+    :param static_folder: The app's static folder
+    :param bundles: Bundle name to the list of files concatenated into it
+    :type bundles: dict
+    :return: The manifest
+    """
+    clean(static_folder)
+
+    sources = []
+    for directory, _, names in os.walk(static_folder):
+        for name in names:
+            path = os.path.relpath(os.path.join(directory, name), static_folder).replace(os.sep, '/')
+            sources.append(path)
+    sources.sort(key=lambda source: (source.endswith('.css'), source))
+
+    files = {}
+    for path in sources:
+        with open(os.path.join(static_folder, path), 'rb') as source:
+            content = source.read()
+        if path.endswith('.css'):
+            content = _rewrite_css_urls(content.decode('utf-8'), path, path, files).encode('utf-8')
+        files[path] = _fingerprint(path, content)
+        _write(static_folder, files[path], content)
+
+    for bundle, members in bundles.items():
+        parts = []
+        for member in members:
+            with open(os.path.join(static_folder, member), 'rb') as source:
+                content = source.read().decode('utf-8')
+            if bundle.endswith('.css'):
+                content = _rewrite_css_urls(content, member, bundle, files)
+            parts.append(content)
+        # Scripts are joined with ';' in case one lacks a trailing semicolon.
+        content = ('\n' if bundle.endswith('.css') else ';\n').join(parts).encode('utf-8')
+        files[bundle] = _fingerprint(bundle, content)
+        _write(static_folder, files[bundle], content)
+
+    manifest = {'files': files, 'bundles': sorted(bundles)}
+    with open(os.path.join(static_folder, MANIFEST_NAME), 'w') as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+    return manifest
+
+
+class AssetPipeline(object):
+    """
+    Serve the static files prepared by build: url_for('static', ...) resolves
+    to fingerprinted names through the manifest, and those are served with a
+    one year immutable Cache-Control, precompressed when the client accepts
+    it. Without a manifest the original files are served as usual.
+
+    Settings:
+      ASSET_BUNDLES: Bundle name to the list of files concatenated into it
+      ASSET_MANIFEST: Use the manifest when one was built
+      ASSET_CACHE_MAX_AGE: Max age of fingerprinted files in seconds
+    """
+
+    def __init__(self, app=None):
+        self.files = {}
+        self.bundles = {}
+        self.fingerprinted = set()
+        self.max_age = 31536000
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.bundles = app.config.get('ASSET_BUNDLES', {})
+        self.max_age = app.config.get('ASSET_CACHE_MAX_AGE', self.max_age)
+        manifest_path = os.path.join(app.static_folder, MANIFEST_NAME)
+        if app.config.get('ASSET_MANIFEST', True) and os.path.exists(manifest_path):
+            with open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+            self.files = manifest['files']
+            self.fingerprinted = set(self.files.values())
+
+        static_folder = app.static_folder
+
+        @app.url_defaults
+        def fingerprint_static_url(endpoint, values):
+            if endpoint == 'static' and 'filename' in values:
+                values['filename'] = self.files.get(values['filename'], values['filename'])
+
+        def static(filename):
+            return self.send_static_file(static_folder, filename)
+
+        app.view_functions['static'] = static
+        app.jinja_env.globals.update(asset_urls=self.asset_urls)
+
+    def asset_urls(self, bundle):
+        """
+        Urls to include a bundle in a page: the bundle itself once built,
+        its individual files otherwise.
+
+        :param bundle: Name of the bundle, e.g. 'styles/bundle.css'
+        :return: list of urls
+        """
+        if bundle in self.files:
+            return [url_for('static', filename=bundle)]
+        return [url_for('static', filename=member) for member in self.bundles.get(bundle, [])]
+
+    def send_static_file(self, static_folder, filename):
+        if filename not in self.fingerprinted:
+            return send_from_directory(static_folder, filename)
+
+        mimetype = mimetypes.guess_type(filename)[0]
+        for encoding, suffix in ENCODINGS:
+            if encoding in request.accept_encodings and \
+                    os.path.exists(os.path.join(static_folder, filename + suffix)):
+                response = send_from_directory(static_folder, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(static_folder, filename)
+
+        response.headers['Cache-Control'] = f'public, max-age={self.max_age}, immutable'
+        response.vary.add('Accept-Encoding')
+        return response
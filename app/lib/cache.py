@@ -0,0 +1,254 @@
+import functools
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request, session, g
+from flask_login import current_user
+from werkzeug.contrib.cache import BaseCache, NullCache
+
+
+class LRUCache(BaseCache):
+    """
+    In process cache bounded by number of entries. The least recently used
+    entry is evicted once max_entries is reached.
+    """
+
+    def __init__(self, max_entries=500, default_timeout=300):
+        super(LRUCache, self).__init__(default_timeout)
+        self._entries = OrderedDict()
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def _expiry(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        return time.time() + timeout if timeout > 0 else 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires and expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._entries[key] = (self._expiry(timeout), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def delete(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        return True
+
+
+class SQLiteCache(BaseCache):
+    """
+    Cache stored in a SQLite file so that every worker process on a host
+    shares the same entries, and a clear() in one worker is seen by all.
+
+    Once max_entries is exceeded the expired entries and then the oldest
+    ones are evicted.
+    """
+
+    def __init__(self, path, max_entries=500, default_timeout=300):
+        super(SQLiteCache, self).__init__(default_timeout)
+        self._path = path
+        self._max_entries = max_entries
+        self._local = threading.local()
+
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS fragment_cache ('
+                               'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                               'expires REAL NOT NULL, created REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_fragment_cache_created '
+                               'ON fragment_cache (created)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute('SELECT value, expires FROM fragment_cache WHERE key = ?',
+                                         (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires and expires < time.time():
+            return None
+        return value
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        now = time.time()
+        expires = now + timeout if timeout > 0 else 0
+
+        with self._connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO fragment_cache (key, value, expires, created) '
+                               'VALUES (?, ?, ?, ?)', (key, value, expires, now))
+            count = connection.execute('SELECT COUNT(*) FROM fragment_cache').fetchone()[0]
+            if count > self._max_entries:
+                count -= connection.execute('DELETE FROM fragment_cache WHERE expires != 0 AND expires < ?',
+                                            (now,)).rowcount
+                if count > self._max_entries:
+                    connection.execute('DELETE FROM fragment_cache WHERE key IN ('
+                                       'SELECT key FROM fragment_cache ORDER BY created LIMIT ?)',
+                                       (count - self._max_entries,))
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+    def has(self, key):
+        return self.get(key) is not None
+
+    def delete(self, key):
+        with self._connection() as connection:
+            return connection.execute('DELETE FROM fragment_cache WHERE key = ?', (key,)).rowcount > 0
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM fragment_cache')
+        return True
+
+
+class FragmentCache(object):
+    """
+    Cache for rendered pages, keyed by endpoint, view arguments, query
+    string, the identity of the logged in user and, below @conditional, the
+    validators of the data.
+
+    Settings:
+      FRAGMENT_CACHE_BACKEND: 'lru' (per process), 'sqlite' (shared by the
+        workers of a host) or 'null' (disabled)
+      FRAGMENT_CACHE_MAX_ENTRIES: Number of pages kept before evicting
+      FRAGMENT_CACHE_TIMEOUT: Seconds a page is kept
+      FRAGMENT_CACHE_SQLITE_PATH: Cache file of the sqlite backend, defaults
+        to fragment_cache.sqlite in the instance folder
+
+    Keys are namespaced by the database URI, so apps sharing a cache file
+    never serve each other's pages. The cache is emptied on startup, since
+    pages rendered by a previous deploy may use other templates.
+    """
+
+    def __init__(self, app=None):
+        self.backend = NullCache()
+        self.namespace = ''
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get('FRAGMENT_CACHE_BACKEND', 'null')
+        max_entries = app.config.get('FRAGMENT_CACHE_MAX_ENTRIES', 500)
+        timeout = app.config.get('FRAGMENT_CACHE_TIMEOUT', 300)
+
+        if backend == 'lru':
+            self.backend = LRUCache(max_entries=max_entries, default_timeout=timeout)
+        elif backend == 'sqlite':
+            path = app.config.get('FRAGMENT_CACHE_SQLITE_PATH')
+            if not path:
+                os.makedirs(app.instance_path, exist_ok=True)
+                path = os.path.join(app.instance_path, 'fragment_cache.sqlite')
+            self.backend = SQLiteCache(path, max_entries=max_entries, default_timeout=timeout)
+        elif backend == 'null':
+            self.backend = NullCache()
+        else:
+            raise ValueError('Unknown FRAGMENT_CACHE_BACKEND {0!r}'.format(backend))
+
+        database_uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+        self.namespace = hashlib.sha1(database_uri.encode('utf-8')).hexdigest()[:12]
+        self.backend.clear()
+
+    def make_key(self):
+        """
+        Build the cache key of the current request.
+
+        :return: str
+        """
+        user = current_user.get_id() if current_user.is_authenticated else 'anonymous'
+        parts = [
+            request.endpoint,
+            repr(sorted(request.view_args.items())),
+            repr(sorted(request.args.items(multi=True))),
+            user,
+            # Validators of @conditional views: pages rendered by any process
+            # before a write are not served after it.
+            str(g.get('conditional_version'))
+        ]
+        return f'fragment:{self.namespace}:' + hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def cached(self, timeout=None):
+        """
+        Cache the HTML returned by a view. Only GET requests without pending
+        flash messages are cached, and only when the view returns a string
+        (redirects and error responses are never stored).
+
+        :param timeout: Seconds to keep the page, defaults to the backend's
+        """
+
+        def decorator(f):
+            @functools.wraps(f)
+            def decorated_function(*args, **kwargs):
+                if request.method != 'GET' or session.get('_flashes'):
+                    return f(*args, **kwargs)
+
+                key = self.make_key()
+                rv = self.backend.get(key)
+                if rv is not None:
+                    self.hits += 1
+                    return rv
+
+                self.misses += 1
+                rv = f(*args, **kwargs)
+                if isinstance(rv, str):
+                    self.backend.set(key, rv, timeout)
+                return rv
+
+            return decorated_function
+
+        return decorator
+
+    def clear(self):
+        """
+        Drop every cached page, called whenever catalog data is written.
+
+        :return: None
+        """
+        self.backend.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
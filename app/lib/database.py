@@ -0,0 +1,231 @@
+import contextlib
+import functools
+import threading
+import time
+import weakref
+
+import flask_sqlalchemy
+from flask import g, session, has_request_context
+from sqlalchemy import event, exc, orm
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+
+
+def use_replica(f):
+    """
+    Let the reads of a view go to the replica database, see RoutingSession.
+
+    Example:
+      @catalog.route('/')
+      @use_replica
+      def home(): ...
+    """
+
+    @functools.wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.use_replica = True
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+@contextlib.contextmanager
+def read_from_primary():
+    """
+    Send the reads of a block to the primary, even in a view decorated with
+    @use_replica. Used to fill process wide caches, which would otherwise
+    keep the state of a lagging replica after it caught up.
+
+    Example:
+      with read_from_primary():
+          categories = Category.get_summaries()
+    """
+    if not has_request_context():
+        yield
+        return
+
+    previous = g.get('use_replica')
+    g.use_replica = False
+    try:
+        yield
+    finally:
+        g.use_replica = previous
+
+
+class RoutingSession(flask_sqlalchemy.SignallingSession):
+    """
+    Session sending the reads of views decorated with @use_replica to the
+    DATABASE_REPLICA_BIND engine, and everything else to the primary.
+
+    The primary is used instead of the replica for:
+      - flushes and Core INSERT, UPDATE and DELETE statements
+      - the rest of a request once it wrote anything
+      - REPLICA_STICKY_SECONDS after a user's own write, remembered in their
+        session, so they read their writes despite replication lag
+
+    Settings:
+      DATABASE_REPLICA_BIND: Name of the replica in SQLALCHEMY_BINDS
+      REPLICA_STICKY_SECONDS: Time a user reads from the primary after writing
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+        elif self._read_from_replica():
+            return self.db.get_engine(self.app, bind=self.app.config['DATABASE_REPLICA_BIND'])
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+    def _read_from_replica(self):
+        if not self.app.config.get('DATABASE_REPLICA_BIND') or self._flushing or self.info.get('wrote'):
+            return False
+        if not has_request_context() or not g.get('use_replica'):
+            return False
+        return session.get('primary_until', 0) < time.time()
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _record_write(db_session, flush_context):
+    db_session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _stick_to_primary(db_session):
+    if db_session.info.get('wrote') and has_request_context() and \
+            db_session.app.config.get('DATABASE_REPLICA_BIND'):
+        session['primary_until'] = time.time() + db_session.app.config['REPLICA_STICKY_SECONDS']
+
+
+class PoolStats(object):
+    def __init__(self, bind):
+        self.bind = bind or 'default'
+        self.connects = 0
+        self.checked_out = 0
+        self.disconnects = 0
+
+
+class SQLAlchemy(flask_sqlalchemy.SQLAlchemy):
+    """
+    Flask-SQLAlchemy configured for a threaded server.
+
+    Pools are sized with Flask-SQLAlchemy's own SQLALCHEMY_POOL_SIZE,
+    SQLALCHEMY_MAX_OVERFLOW, SQLALCHEMY_POOL_TIMEOUT and
+    SQLALCHEMY_POOL_RECYCLE settings. SQLite files get a pool of reused
+    connections too unless SQLALCHEMY_POOL_SIZE is 0. Every engine also
+    gets:
+
+      - a ping of PostgreSQL connections on checkout, so connections closed
+        by the server are replaced before use rather than failing a request
+      - a statement timeout on PostgreSQL
+      - WAL journaling and a busy timeout on SQLite, so readers don't block
+        on the writer and writers wait for the lock instead of failing
+
+    Reads can be routed to a replica database, see RoutingSession.
+
+    Settings:
+      SQLALCHEMY_POOL_PRE_PING: Ping connections on checkout
+      DATABASE_STATEMENT_TIMEOUT: PostgreSQL statement timeout in ms
+      SQLITE_PRAGMAS: PRAGMAs run on every new SQLite connection
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._pool_stats = weakref.WeakKeyDictionary()
+        self._configure_lock = threading.Lock()
+        super(SQLAlchemy, self).__init__(*args, **kwargs)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_app(self, app):
+        app.config.setdefault('DATABASE_REPLICA_BIND', None)
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 10)
+        app.config.setdefault('SQLALCHEMY_POOL_PRE_PING', True)
+        app.config.setdefault('DATABASE_STATEMENT_TIMEOUT', None)
+        app.config.setdefault('SQLITE_PRAGMAS', {})
+        super(SQLAlchemy, self).init_app(app)
+
+    def apply_driver_hacks(self, app, info, options):
+        super(SQLAlchemy, self).apply_driver_hacks(app, info, options)
+
+        if info.drivername.startswith('sqlite'):
+            if options.get('poolclass') is None:
+                # SQLAlchemy defaults to a NullPool for SQLite files. Pooled
+                # connections are handed from thread to thread, one at a time.
+                options['poolclass'] = QueuePool
+                options.setdefault('connect_args', {})['check_same_thread'] = False
+            elif options['poolclass'] is not QueuePool:
+                for option in ('pool_size', 'max_overflow', 'pool_timeout'):
+                    options.pop(option, None)
+
+        timeout = app.config['DATABASE_STATEMENT_TIMEOUT']
+        if timeout and info.drivername.startswith('postgresql'):
+            connect_args = options.setdefault('connect_args', {})
+            connect_args['options'] = ' '.join(filter(None, [connect_args.get('options'),
+                                                             f'-c statement_timeout={int(timeout)}']))
+
+    def get_engine(self, app=None, bind=None):
+        engine = super(SQLAlchemy, self).get_engine(app, bind)
+        if engine not in self._pool_stats:
+            with self._configure_lock:
+                if engine not in self._pool_stats:
+                    self._configure_engine(engine, self.get_app(app).config, bind)
+        return engine
+
+    def _configure_engine(self, engine, config, bind):
+        stats = PoolStats(bind)
+        sqlite = engine.dialect.name == 'sqlite'
+        pragmas = config['SQLITE_PRAGMAS'] if sqlite else {}
+        ping = config['SQLALCHEMY_POOL_PRE_PING'] and not sqlite
+        dbapi_error = engine.dialect.dbapi.Error
+
+        def connect(dbapi_connection, connection_record):
+            stats.connects += 1
+            if pragmas:
+                cursor = dbapi_connection.cursor()
+                for name, value in pragmas.items():
+                    cursor.execute(f'PRAGMA {name} = {value}')
+                cursor.close()
+
+        def checkout(dbapi_connection, connection_record, connection_proxy):
+            if ping:
+                # Raw cursor: the ping is not a statement of the request.
+                try:
+                    cursor = dbapi_connection.cursor()
+                    cursor.execute('SELECT 1')
+                    cursor.close()
+                except dbapi_error:
+                    stats.disconnects += 1
+                    # The pool discards the connection and retries.
+                    raise exc.DisconnectionError()
+            stats.checked_out += 1
+
+        def checkin(dbapi_connection, connection_record):
+            stats.checked_out -= 1
+
+        event.listen(engine, 'connect', connect)
+        event.listen(engine, 'checkout', checkout)
+        event.listen(engine, 'checkin', checkin)
+        self._pool_stats[engine] = stats
+
+    def pool_status(self):
+        """
+        Connection counts of every engine created so far, by bind.
+
+        :return: list of dicts
+        """
+        status = []
+        for engine, stats in list(self._pool_stats.items()):
+            pool = engine.pool
+            entry = {
+                'bind': stats.bind,
+                'connects': stats.connects,
+                'checked_out': stats.checked_out,
+                'disconnects': stats.disconnects
+            }
+            if isinstance(pool, QueuePool):
+                entry.update(size=pool.size(), overflow=max(pool.overflow(), 0), checked_in=pool.checkedin())
+            status.append(entry)
+        return status
@@ -0,0 +1,129 @@
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from PIL import Image
+
+from app.lib.storage import UPLOAD_PREFIX
+
+logger = logging.getLogger(__name__)
+
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True}
+}
+
+
+def make_variants(path, sizes, root=None):
+    """
+    Write a resized copy of an image next to it for every size. Images are
+    only ever scaled down and keep their aspect ratio.
+
+    Example:
+      make_variants('/uploads/ab/cd/abcd.jpg', {'thumbnail': (300, 200)}, root='/uploads')
+      -> {'thumbnail': 'ab/cd/abcd_thumbnail.jpg'}
+
+    :param path: Path of the original image
+    :param sizes: Maximum (width, height) of every variant by name
+    :type sizes: dict
+    :param root: Directory the returned names are relative to, defaults to
+      the directory of the image
+    :return: dict of variant name to file name, with / separators
+    """
+    root = root or os.path.dirname(path)
+    stem, ext = os.path.splitext(path)
+    variants = {}
+
+    for name, size in sizes.items():
+        target = f'{stem}_{name}{ext}'
+        variants[name] = os.path.relpath(target, root).replace(os.sep, '/')
+        if _is_complete(target):
+            # Content addressed originals never change, nor do their variants.
+            continue
+
+        with Image.open(path) as image:
+            image_format = image.format
+            if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            image.thumbnail(size, Image.ANTIALIAS)
+            _save_atomically(image, target, image_format)
+
+    return variants
+
+
+def _is_complete(path):
+    # Variants are moved into place once written, but a file left by an
+    # older version, or damaged on disk, is written again.
+    try:
+        with Image.open(path) as image:
+            image.verify()
+        return True
+    except (IOError, OSError, SyntaxError, ValueError):
+        return False
+
+
+def _save_atomically(image, target, image_format):
+    """
+    Write an image to a temporary file next to target and move it into
+    place, so a crash or a concurrent identical upload never leaves a
+    truncated variant behind.
+    """
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix=UPLOAD_PREFIX)
+    try:
+        with os.fdopen(handle, 'wb') as temp_file:
+            image.save(temp_file, image_format, **SAVE_OPTIONS.get(image_format, {}))
+        os.replace(temp_path, target)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class ImagePipeline(object):
+    """
+    Resize uploaded images on a pool of worker threads so that requests
+    never wait for image work.
+
+    Settings:
+      IMAGE_WORKERS: Size of the pool, 0 processes images inline
+      IMAGE_VARIANTS: Maximum (width, height) of every variant by name
+    """
+
+    def __init__(self, app=None):
+        self.executor = None
+        self.sizes = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        workers = app.config.get('IMAGE_WORKERS', 2)
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers else None
+        self.sizes = app.config.get('IMAGE_VARIANTS', {})
+
+    def submit(self, path, on_done, root=None):
+        """
+        Queue an image for processing.
+
+        :param path: Path of the uploaded image
+        :param on_done: Called with the dict returned by make_variants, inside
+          an application context, once the variants are written
+        :param root: Directory the variant names are relative to, e.g. the
+          root of the upload store
+        :return: Future, or None when processing inline
+        """
+        app = current_app._get_current_object()
+        if self.executor is None:
+            return self._process(app, path, on_done, root)
+        return self.executor.submit(self._process, app, path, on_done, root)
+
+    def _process(self, app, path, on_done, root):
+        try:
+            variants = make_variants(path, self.sizes, root)
+        except (IOError, OSError):
+            logger.exception('Could not process image %s', path)
+            return None
+
+        with app.app_context():
+            on_done(variants)
+        return None
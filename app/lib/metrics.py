@@ -0,0 +1,195 @@
+import bisect
+import threading
+import time
+from collections import defaultdict
+
+from flask import g, request, current_app, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join('{0}="{1}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+                     for name, value in labels)
+    return '{' + pairs + '}'
+
+
+class Counter(object):
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] += amount
+
+    def expose(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f'{self.name}{_format_labels(labels)} {value}'
+
+
+class Histogram(object):
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # Per label set: [count per bucket (+Inf last), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def expose(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(labels)} {total}'
+            yield f'{self.name}_count{_format_labels(labels)} {cumulative}'
+
+
+class Metrics(object):
+    """
+    Per process request, SQL and template metrics, exposed at /metrics in
+    the Prometheus text format. Nothing is hooked into the app unless
+    METRICS_ENABLED is set, so disabled metrics cost nothing.
+
+    Other parts of the app publish gauges, such as cache hit ratios, with
+    register_collector().
+
+    Settings:
+      METRICS_ENABLED: Collect and expose metrics
+      METRICS_PATH: Url of the metrics endpoint
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.collectors = {}
+        self.request_duration = Histogram('catalog_request_duration_seconds',
+                                          'Time spent handling requests by endpoint.')
+        self.sql_statements = Counter('catalog_sql_statements_total',
+                                      'SQL statements executed by endpoint.')
+        self.sql_duration = Counter('catalog_sql_duration_seconds_total',
+                                    'Time spent executing SQL statements by endpoint.')
+        self.template_duration = Histogram('catalog_template_render_seconds',
+                                           'Time spent rendering templates by template.')
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('METRICS_ENABLED'):
+            return None
+        self.enabled = True
+
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._start_template, app)
+        template_rendered.connect(self._end_template, app)
+        # Listeners on the Engine class see every engine, including binds.
+        if not event.contains(Engine, 'before_cursor_execute', self._start_statement):
+            event.listen(Engine, 'before_cursor_execute', self._start_statement)
+            event.listen(Engine, 'after_cursor_execute', self._end_statement)
+
+        app.add_url_rule(app.config.get('METRICS_PATH', '/metrics'), 'metrics', self.metrics_view)
+        return None
+
+    def register_collector(self, name, collector):
+        """
+        Register a callable returning samples to expose on every scrape, as a
+        list of (metric name, type, documentation, [(labels dict, value)]).
+        Registering another collector under the same name replaces it.
+
+        :param name: Name of the collector
+        :param collector: Callable
+        :return: None
+        """
+        self.collectors[name] = collector
+        return None
+
+    @staticmethod
+    def _endpoint():
+        return (request.endpoint or 'none') if has_request_context() else 'none'
+
+    @staticmethod
+    def _start_request():
+        g.metrics_started = time.perf_counter()
+
+    def _end_request(self, response):
+        self._observe_request(response.status_code)
+        return response
+
+    def _teardown_request(self, exc):
+        # Unhandled exceptions skip after_request handlers.
+        if exc is not None:
+            self._observe_request(500)
+
+    def _observe_request(self, status):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            self.request_duration.observe(time.perf_counter() - started, endpoint=self._endpoint(),
+                                          method=request.method, status=status)
+
+    @staticmethod
+    def _start_template(sender, template, context, **extra):
+        g.setdefault('metrics_templates', []).append(time.perf_counter())
+
+    def _end_template(self, sender, template, context, **extra):
+        starts = g.get('metrics_templates')
+        if starts:
+            self.template_duration.observe(time.perf_counter() - starts.pop(), template=template.name)
+
+    @staticmethod
+    def _start_statement(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_statements', []).append(time.perf_counter())
+
+    def _end_statement(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_statements')
+        if starts:
+            endpoint = self._endpoint()
+            self.sql_statements.inc(endpoint=endpoint)
+            self.sql_duration.inc(time.perf_counter() - starts.pop(), endpoint=endpoint)
+
+    def expose(self):
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        :return: str
+        """
+        lines = []
+        for metric in (self.request_duration, self.sql_statements, self.sql_duration, self.template_duration):
+            lines.extend(metric.expose())
+
+        for collector in list(self.collectors.values()):
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(sorted(labels.items()))} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        return current_app.response_class(self.expose(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,18 @@
+from flask.sessions import SecureCookieSessionInterface
+
+
+class LazySessionInterface(SecureCookieSessionInterface):
+    """
+    Signed cookie sessions that are made permanent, expiring after
+    PERMANENT_SESSION_LIFETIME, only once something is stored in them.
+
+    Requests that never write to the session, such as anonymous page views,
+    neither modify it nor receive a Set-Cookie header, which leaves their
+    responses cacheable by a proxy. Permanent sessions are still refreshed
+    on every request (SESSION_REFRESH_EACH_REQUEST).
+    """
+
+    def save_session(self, app, session, response):
+        if session and not session.permanent:
+            session.permanent = True
+        return super(LazySessionInterface, self).save_session(app, session, response)
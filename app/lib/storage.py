@@ -0,0 +1,316 @@
+import hashlib
+import os
+import tempfile
+import time
+
+from flask import Request, current_app
+from flask_login import current_user
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.security import safe_join
+
+# Leading bytes of the accepted file types and the extension they are
+# stored with.
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png', '.png'),
+    (b'GIF87a', 'gif', '.gif'),
+    (b'GIF89a', 'gif', '.gif'),
+)
+SNIFF_LENGTH = max(len(signature) for signature, _, _ in SIGNATURES)
+
+# Name prefix of the temporary files of uploads in progress.
+UPLOAD_PREFIX = '.upload-'
+
+
+def sniff(head):
+    """
+    Identify a file from its first bytes.
+
+    :param head: At least SNIFF_LENGTH leading bytes, or the whole file
+    :return: tuple of (type, extension), (None, '') when unknown
+    """
+    for signature, kind, ext in SIGNATURES:
+        if head.startswith(signature):
+            return kind, ext
+    return None, ''
+
+
+class ContentStore(object):
+    """
+    File store where every file is named after the SHA-256 of its content
+    and sharded over two levels of directories, e.g.
+
+      ab/cd/abcd1234...ef.jpg
+
+    Identical uploads are stored once, and since a name never points to
+    different content, files can be cached forever by clients.
+
+    Resized variants live next to their original as <hash>_<variant><ext>.
+
+    Settings:
+      UPLOAD_FOLDER: Root of the store, instance/uploads by default
+      IMAGE_VARIANTS: Names of the variants deleted along with an original
+    """
+
+    def __init__(self, app=None):
+        self.root = None
+        self.variant_names = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.root = app.config.get('UPLOAD_FOLDER') or os.path.join(app.instance_path, 'uploads')
+        self.variant_names = list(app.config.get('IMAGE_VARIANTS', {}))
+        app.extensions['upload_store'] = self
+
+    def path(self, key):
+        """
+        Absolute path of a key, or None if it points outside of the store.
+
+        :param key: Relative path as returned by put
+        :return: str or None
+        """
+        return safe_join(self.root, key)
+
+    def open_upload(self, max_size=None, allowed_types=None):
+        """
+        Open a file to write an upload into, see PendingUpload.
+
+        :return: PendingUpload
+        """
+        return PendingUpload(self, max_size=max_size, allowed_types=allowed_types)
+
+    def put(self, stream, max_size=None, allowed_types=None, chunk_size=1 << 16):
+        """
+        Store the content of a binary stream.
+
+        :param stream: Binary file object
+        :param max_size: Reject content larger than this many bytes
+        :param allowed_types: Reject content not sniffed as one of these types
+        :param chunk_size: Bytes copied at a time
+        :return: Key of the stored file
+        """
+        upload = self.open_upload(max_size=max_size, allowed_types=allowed_types)
+        try:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                upload.write(chunk)
+            return upload.commit()
+        finally:
+            upload.close()
+
+    def save(self, file_storage, max_size=None, allowed_types=None):
+        """
+        Store an uploaded file. Files already streamed into the store by
+        StreamingUploadRequest are just renamed into place.
+
+        :param file_storage: Werkzeug FileStorage
+        :return: Key of the stored file
+        """
+        if isinstance(file_storage.stream, PendingUpload):
+            return file_storage.stream.commit()
+        return self.put(file_storage.stream, max_size=max_size, allowed_types=allowed_types)
+
+    def variant_keys(self, key):
+        stem, ext = os.path.splitext(key)
+        return [f'{stem}_{name}{ext}' for name in self.variant_names]
+
+    def delete(self, key):
+        """
+        Delete a file and its variants.
+
+        :param key: Key of the original file
+        :return: None
+        """
+        for variant_key in [key] + self.variant_keys(key):
+            path = self.path(variant_key)
+            if path and os.path.isfile(path):
+                os.remove(path)
+        return None
+
+    def iter_keys(self):
+        """
+        Yield the key of every original file in the store, variants and
+        temporary files excluded.
+        """
+        suffixes = tuple(f'_{name}' for name in self.variant_names)
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                stem = os.path.splitext(name)[0]
+                if name.startswith('.') or name == 'README' or stem.endswith(suffixes):
+                    continue
+                yield os.path.relpath(os.path.join(directory, name), self.root).replace(os.sep, '/')
+
+    def is_older(self, key, max_age):
+        """
+        Tell whether a file was stored, or uploaded again, more than max_age
+        seconds ago.
+
+        :param key: Key of the original file
+        :param max_age: Seconds
+        :return: bool
+        """
+        path = self.path(key)
+        try:
+            return os.path.getmtime(path) < time.time() - max_age
+        except OSError:
+            return False
+
+    def iter_orphans(self, referenced, max_age):
+        """
+        Yield the keys of the files no item refers to which were stored more
+        than max_age seconds ago. The age is checked last: files uploaded
+        again since the references were read are recent.
+
+        :param referenced: Keys still in use
+        :type referenced: set
+        :param max_age: Seconds
+        """
+        for key in list(self.iter_keys()):
+            if key not in referenced and self.is_older(key, max_age):
+                yield key
+
+    def iter_stale_uploads(self, max_age):
+        """
+        Yield the paths of the temporary files of uploads, and of image
+        variants, started more than max_age seconds ago, which nothing is
+        still writing.
+
+        :param max_age: Seconds
+        """
+        if not self.root or not os.path.isdir(self.root):
+            return
+        cutoff = time.time() - max_age
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                if name.startswith(UPLOAD_PREFIX) and os.path.getmtime(path) < cutoff:
+                    yield path
+
+
+class PendingUpload(object):
+    """
+    File like object receiving an upload chunk by chunk. It is written to a
+    temporary file in the store while being hashed, and is only named after
+    its hash by commit().
+
+    The type is sniffed from the first bytes and the size checked on every
+    write, so a bad upload is rejected before the rest of the body is read.
+    The temporary file is removed on close() unless committed, and as soon
+    as the upload is rejected. Files left behind by a crashed process are
+    swept by ContentStore.iter_stale_uploads.
+    """
+
+    def __init__(self, store, max_size=None, allowed_types=None):
+        self.store = store
+        self.max_size = max_size
+        self.allowed_types = allowed_types
+        self.size = 0
+        self.kind = None
+        self.ext = ''
+        self.committed = False
+        self._head = b''
+        self._digest = hashlib.sha256()
+
+        os.makedirs(store.root, exist_ok=True)
+        handle, self._temp_path = tempfile.mkstemp(dir=store.root, prefix=UPLOAD_PREFIX)
+        self._file = os.fdopen(handle, 'w+b')
+
+    def write(self, data):
+        try:
+            self.size += len(data)
+            if self.max_size is not None and self.size > self.max_size:
+                raise RequestEntityTooLarge()
+
+            if len(self._head) < SNIFF_LENGTH:
+                self._head += data[:SNIFF_LENGTH - len(self._head)]
+                if len(self._head) >= SNIFF_LENGTH:
+                    self._check_type()
+
+            self._digest.update(data)
+            self._file.write(data)
+        except Exception:
+            # Werkzeug drops a stream whose parsing failed without closing
+            # it, so the temporary file is removed here.
+            self.close()
+            raise
+
+    def _check_type(self):
+        self.kind, self.ext = sniff(self._head)
+        if self.allowed_types is not None and self.kind not in self.allowed_types:
+            raise UnsupportedMediaType()
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        return self._file.flush()
+
+    def commit(self):
+        """
+        Move the upload to its content addressed location.
+
+        :return: Key of the stored file
+        """
+        if self.committed:
+            return self.key
+        if len(self._head) < SNIFF_LENGTH:
+            # Files shorter than the longest signature.
+            try:
+                self._check_type()
+            except UnsupportedMediaType:
+                self.close()
+                raise
+
+        self._file.close()
+        content_hash = self._digest.hexdigest()
+        self.key = f'{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{self.ext}'
+        path = self.store.path(self.key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            # Identical upload: touched so gc_uploads, which only deletes
+            # files older than its grace period, keeps it until the item
+            # referring to it is saved.
+            os.utime(path)
+            os.remove(self._temp_path)
+        except FileNotFoundError:
+            os.replace(self._temp_path, path)
+        self.committed = True
+        return self.key
+
+    def close(self):
+        self._file.close()
+        if not self.committed and os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+
+class StreamingUploadRequest(Request):
+    """
+    Request class writing uploaded files straight into the upload store while
+    the body is parsed, instead of buffering them in memory or in a spooled
+    temporary file first.
+
+    Only the files posted to UPLOAD_STREAMING_ENDPOINTS by logged in users
+    are streamed into the store; every other request gets Werkzeug's
+    default temporary files.
+
+    Settings:
+      UPLOAD_STREAMING_ENDPOINTS: Endpoints receiving uploads
+      UPLOAD_MAX_SIZE: Largest accepted file in bytes
+      UPLOAD_ALLOWED_TYPES: Sniffed types accepted, e.g. ('jpeg', 'png')
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.endpoint not in current_app.config.get('UPLOAD_STREAMING_ENDPOINTS', ()) or \
+                not current_user.is_authenticated:
+            return super(StreamingUploadRequest, self)._get_file_stream(
+                total_content_length, content_type, filename, content_length)
+
+        store = current_app.extensions['upload_store']
+        return store.open_upload(max_size=current_app.config.get('UPLOAD_MAX_SIZE'),
+                                 allowed_types=current_app.config.get('UPLOAD_ALLOWED_TYPES'))
@@ -0,0 +1,73 @@
+import functools
+import hashlib
+
+from flask import request, session, current_app, make_response, g
+from flask_login import current_user
+
+
+def _not_modified(etag, last_modified):
+    # If-None-Match takes precedence over If-Modified-Since (RFC 7232 6).
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified.replace(microsecond=0, tzinfo=None) <= \
+               request.if_modified_since.replace(tzinfo=None)
+
+    return False
+
+
+def conditional(get_validators):
+    """
+    Answer conditional GET requests with a 304 before the view runs.
+
+    The ETag is derived from the validator and the identity of the logged
+    in user, because the same URL renders differently once logged in. Pages
+    cached by FragmentCache are keyed by the validator too, so a page is
+    never served under the ETag of newer data.
+
+    Example:
+      @conditional(catalog_validators)
+      def home(): ...
+
+    :param get_validators: Callable returning a (version, last_modified)
+      tuple. version is any string that changes with the data, last_modified
+      is a naive UTC datetime or None.
+    """
+
+    def decorator(f):
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                return f(*args, **kwargs)
+
+            version, last_modified = get_validators()
+            # Part of the rendered page cache key, see FragmentCache.make_key.
+            g.conditional_version = version
+            user = current_user.get_id() if current_user.is_authenticated else 'anonymous'
+            etag = hashlib.sha1('{0}|{1}|{2}'.format(request.endpoint, version, user)
+                                .encode('utf-8')).hexdigest()
+
+            if _not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            # Anonymous responses carry no session cookie, so shared caches
+            # may keep them and revalidate with the ETag.
+            if current_user.is_authenticated:
+                response.cache_control.private = True
+            else:
+                response.cache_control.public = True
+            response.vary.add('Cookie')
+            return response
+
+        return decorated_function
+
+    return decorator
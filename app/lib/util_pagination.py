@@ -0,0 +1,118 @@
+import base64
+import binascii
+import datetime
+import json
+
+from flask import abort
+from flask_sqlalchemy import Pagination
+
+CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when a client supplied pagination cursor cannot be decoded.
+    """
+    pass
+
+
+def encode_cursor(*values):
+    """
+    Encode the sort key of the last row of a page into an opaque, url safe
+    cursor string.
+
+    Example:
+      encode_cursor(item.updated_on, item.id) -> 'WyIyMDE3LTAxLTIwVDA1OjIz...'
+
+    :param values: Values making up the keyset (datetimes and/or ints)
+    :return: str
+    """
+    parts = []
+    for value in values:
+        if isinstance(value, datetime.datetime):
+            value = value.strftime(CURSOR_DATETIME_FORMAT)
+        parts.append(value)
+
+    raw = json.dumps(parts, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, *types):
+    """
+    Decode a cursor created by encode_cursor.
+
+    :param cursor: Cursor as received from the client
+    :type cursor: str
+    :param types: Expected type of every value in the keyset
+    :return: tuple
+    """
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        parts = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursor(cursor)
+
+    if not isinstance(parts, list) or len(parts) != len(types):
+        raise InvalidCursor(cursor)
+
+    values = []
+    for value, kind in zip(parts, types):
+        try:
+            if kind is datetime.datetime:
+                value = datetime.datetime.strptime(value, CURSOR_DATETIME_FORMAT)
+            else:
+                value = kind(value)
+        except (TypeError, ValueError):
+            raise InvalidCursor(cursor)
+        values.append(value)
+
+    return tuple(values)
+
+
+class UncountedPagination(Pagination):
+    """
+    A Flask-SQLAlchemy Pagination that does not know the total number of
+    rows. Whether a next page exists is decided by fetching one row more than
+    the page size, which avoids a COUNT(*) over the whole result set.
+    """
+
+    def __init__(self, query, page, per_page, items, has_next):
+        super(UncountedPagination, self).__init__(query, page, per_page, None, items)
+        self._has_next = has_next
+
+    @property
+    def pages(self):
+        return self.page + 1 if self._has_next else self.page
+
+    @property
+    def has_next(self):
+        return self._has_next
+
+
+def paginate(query, page, per_page, error_out=True, count=True, total=None):
+    """
+    Paginate a query, optionally without counting the total number of rows.
+
+    :param query: Flask-SQLAlchemy query
+    :param page: 1 based page number
+    :param per_page: Number of rows per page
+    :param error_out: Abort with a 404 for out of range pages
+    :param count: Issue a COUNT query to compute the exact total
+    :type count: bool
+    :param total: Total number of rows when already known, e.g. from a
+      maintained counter, used instead of a COUNT query
+    :return: Pagination
+    """
+    if total is None and count:
+        return query.paginate(page, per_page, error_out)
+
+    if error_out and page < 1:
+        abort(404)
+
+    rows = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    if error_out and not rows and page != 1:
+        abort(404)
+
+    if total is not None:
+        return Pagination(query, page, per_page, total, rows[:per_page])
+    return UncountedPagination(query, page, per_page, rows[:per_page], len(rows) > per_page)
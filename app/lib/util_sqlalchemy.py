@@ -0,0 +1,123 @@
+import functools
+import threading
+
+from flask import current_app
+from sqlalchemy import event, DateTime
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+_local = threading.local()
+_listener_lock = threading.Lock()
+_listener_installed = False
+
+
+class utcnow(FunctionElement):
+    """
+    Current UTC time as a naive timestamp, read from the database clock, for
+    column defaults. The timestamps written by the app are all naive UTC,
+    while func.now() follows the session time zone on PostgreSQL and only
+    has a one second resolution on SQLite.
+
+    Example:
+      updated_on = db.Column(db.DateTime(), server_default=utcnow(), onupdate=utcnow())
+    """
+    type = DateTime()
+
+
+@compiles(utcnow)
+def _utcnow(element, compiler, **kw):
+    return 'CURRENT_TIMESTAMP'
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    return "timezone('utc', now())"
+
+
+@compiles(utcnow, 'sqlite')
+def _utcnow_sqlite(element, compiler, **kw):
+    # Microseconds in the format SQLAlchemy stores and parses, parenthesized
+    # to be allowed as a column DEFAULT.
+    return "(strftime('%Y-%m-%d %H:%M:%f000', 'now'))"
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    for counter in getattr(_local, 'counters', ()):
+        counter.statements.append(statement)
+
+
+def _install_listener():
+    global _listener_installed
+
+    with _listener_lock:
+        if not _listener_installed:
+            event.listen(Engine, 'before_cursor_execute', _record_statement)
+            _listener_installed = True
+
+
+class QueryCounter(object):
+    """
+    Count the SQL statements executed by the current thread while the
+    context manager is active.
+
+    Example:
+      with QueryCounter() as counter:
+          client.get('/')
+      assert counter.count == 3
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def __enter__(self):
+        _install_listener()
+        if not hasattr(_local, 'counters'):
+            _local.counters = []
+        _local.counters.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _local.counters.remove(self)
+
+
+def query_budget(max_statements):
+    """
+    Decorate a view with the maximum number of SQL statements it may issue,
+    template rendering included.
+
+    Going over budget raises QueryBudgetExceeded when the
+    QUERY_BUDGET_STRICT setting is enabled (useful in tests) and logs a
+    warning otherwise.
+
+    :param max_statements: Number of statements allowed per request
+    :type max_statements: int
+    """
+
+    def decorator(f):
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs):
+            with QueryCounter() as counter:
+                response = f(*args, **kwargs)
+
+            if counter.count > max_statements:
+                message = '{0} issued {1} SQL statements, budget is {2}'.format(
+                    f.__name__, counter.count, max_statements)
+                if current_app.config.get('QUERY_BUDGET_STRICT'):
+                    raise QueryBudgetExceeded(message)
+                current_app.logger.warning(message)
+
+            return response
+
+        decorated_function.query_budget = max_statements
+        return decorated_function
+
+    return decorator
@@ -1,16 +1,22 @@
 import datetime
 
+from sqlalchemy import select, bindparam
 
 from app.extensions import db
+from app.lib.util_sqlalchemy import utcnow
 
 
 class ResourceMixin(object):
-    # Keep track when records are created and updated.
+    # Keep track when records are created and updated, using the database
+    # clock on every statement. The server defaults cover rows written with
+    # plain SQL; the client side ones tables created before they existed.
     created_on = db.Column(db.DateTime(),
-                           default=datetime.datetime.utcnow())
+                           default=utcnow(),
+                           server_default=utcnow())
     updated_on = db.Column(db.DateTime(),
-                           default=datetime.datetime.utcnow(),
-                           onupdate=datetime.datetime.utcnow())
+                           default=utcnow(),
+                           server_default=utcnow(),
+                           onupdate=utcnow())
 
     def save(self):
         """
@@ -20,6 +26,7 @@ class ResourceMixin(object):
         """
         db.session.add(self)
         db.session.commit()
+        self.after_save()
 
         return self
 
@@ -30,7 +37,27 @@ class ResourceMixin(object):
         :return: db.session.commit()'s result
         """
         db.session.delete(self)
-        return db.session.commit()
+        result = db.session.commit()
+        self.after_delete()
+
+        return result
+
+    def after_save(self):
+        """
+        Hook called once save() has committed. Override to invalidate caches
+        derived from the model.
+
+        :return: None
+        """
+        pass
+
+    def after_delete(self):
+        """
+        Hook called once delete() has committed.
+
+        :return: None
+        """
+        pass
 
     def __str__(self):
         """
@@ -43,3 +70,51 @@ class ResourceMixin(object):
 
         values = ', '.join("%s=%r" % (n, getattr(self, n)) for n in columns)
         return '<%s %s(%s)>' % (obj_id, self.__class__.__name__, values)
+
+
+def repair_timestamps(model, batch_size=1000):
+    """
+    Give sane created_on and updated_on values to the rows of a model, in
+    batches of ids each committed on its own so writers are never blocked
+    for long:
+
+      - missing timestamps are set from the other one, or to now
+      - timestamps in the future are set to now
+      - updated_on is never before created_on
+
+    Rows written while the defaults were evaluated once per process hold
+    the start time of that process. Their real times are lost, but once
+    repaired no row sorts ahead of a later write.
+
+    :param model: Model using ResourceMixin
+    :param batch_size: Rows read and updated per transaction
+    :return: Number of repaired rows
+    """
+    table = model.__table__
+    now = datetime.datetime.utcnow()
+    statement = table.update().where(table.c.id == bindparam('_id')) \
+        .values(created_on=bindparam('created_on'), updated_on=bindparam('updated_on'))
+    repaired = 0
+    last_id = None
+
+    while True:
+        query = select([table.c.id, table.c.created_on, table.c.updated_on]).order_by(table.c.id).limit(batch_size)
+        if last_id is not None:
+            query = query.where(table.c.id > last_id)
+        rows = db.session.execute(query).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        updates = []
+        for row in rows:
+            created_on = min(row.created_on or row.updated_on or now, now)
+            updated_on = min(max(row.updated_on or created_on, created_on), now)
+            if (created_on, updated_on) != (row.created_on, row.updated_on):
+                updates.append({'_id': row.id, 'created_on': created_on, 'updated_on': updated_on})
+        if updates:
+            db.session.execute(statement, updates)
+        db.session.commit()
+        repaired += len(updates)
+
+    return repaired
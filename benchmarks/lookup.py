@@ -0,0 +1,87 @@
+"""
+Time the case insensitive Item.get_item lookup as the item table grows.
+
+    python -m benchmarks.lookup --sizes 1000,10000,100000
+
+Pass --without-indexes to drop the lower(name) indexes and compare against a
+full scan.
+"""
+import os
+import random
+import tempfile
+import time
+
+import click
+
+from app.app import create_app
+from app.blueprints.catalog.models import Category, Item
+from app.extensions import db
+
+CATEGORIES = 10
+LOWER_NAME_INDEXES = ('ix_category_lower_name', 'ix_item_category_lower_name')
+
+
+def _grow_items(start, stop):
+    table = Item.__table__
+    batch = []
+    for item_id in range(start, stop):
+        batch.append({
+            'id': item_id + 1,
+            'name': f'Item {item_id}',
+            'description': 'Benchmark item',
+            'category_id': item_id % CATEGORIES + 1
+        })
+        if len(batch) == 10000:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+    db.session.commit()
+
+
+def _time_lookups(size, lookups):
+    ids = [random.randrange(size) for _ in range(lookups)]
+    started = time.perf_counter()
+    for item_id in ids:
+        Item.get_item(f'CATEGORY {item_id % CATEGORIES + 1}', f'item {item_id}')
+        db.session.remove()
+    return (time.perf_counter() - started) / lookups
+
+
+@click.command()
+@click.option('--sizes', default='1000,10000,100000', help='Comma separated item counts')
+@click.option('--lookups', default=500, help='Lookups timed per size')
+@click.option('--without-indexes', is_flag=True, help='Drop the lower(name) indexes first')
+def lookup(sizes, lookups, without_indexes):
+    """
+    Print the mean Item.get_item latency for every table size.
+    """
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'OAUTH_CONFIG': {},
+        'FRAGMENT_CACHE_BACKEND': 'null'
+    })
+
+    try:
+        with app.app_context():
+            db.create_all()
+            if without_indexes:
+                for name in LOWER_NAME_INDEXES:
+                    db.session.execute(f'DROP INDEX {name}')
+            db.session.bulk_save_objects([Category(id=i, name=f'Category {i}') for i in range(1, CATEGORIES + 1)])
+            db.session.commit()
+
+            print(f"{'items':>10} {'lookup (us)':>12}")
+            count = 0
+            for size in sorted(int(size) for size in sizes.split(',')):
+                _grow_items(count, size)
+                count = size
+                print(f"{size:>10} {_time_lookups(size, lookups) * 1e6:>12.1f}")
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    lookup()
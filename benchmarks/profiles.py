@@ -0,0 +1,52 @@
+"""
+Compare requests/sec of the development and production configuration
+profiles through the Flask test client.
+
+    python -m benchmarks.profiles --requests 500
+
+Pass --no-cache to disable the rendered page cache in both profiles and
+measure rendering itself.
+"""
+import click
+
+from benchmarks.util import make_app, remove_database, time_requests
+
+URLS = (
+    '/',
+    '/catalog/Baseball/items',
+    '/catalog/Baseball/items/Bat',
+    '/api/v1/catalog',
+    '/api/v2/catalog'
+)
+
+
+@click.command()
+@click.option('--requests', default=500, help='Requests per url and profile')
+@click.option('--cache/--no-cache', default=True, help='Keep the rendered page cache enabled')
+def profiles(requests, cache):
+    """
+    Print requests/sec per url for each configuration profile.
+    """
+    settings = {} if cache else {'FRAGMENT_CACHE_BACKEND': 'null'}
+    results = {}
+    for env in ('development', 'production'):
+        app = make_app(env, **settings)
+        try:
+            client = app.test_client()
+            for url in URLS:
+                # Warm up caches and compiled templates.
+                time_requests(client, url, 5)
+                latencies = time_requests(client, url, requests)
+                results[(env, url)] = len(latencies) / sum(latencies)
+        finally:
+            remove_database(app)
+
+    print(f"{'url':<32} {'development':>12} {'production':>12} {'speedup':>8}")
+    for url in URLS:
+        development = results[('development', url)]
+        production = results[('production', url)]
+        print(f"{url:<32} {development:>12.0f} {production:>12.0f} {production / development:>7.2f}x")
+
+
+if __name__ == '__main__':
+    profiles()
@@ -0,0 +1,200 @@
+"""
+Benchmark the catalog pages, JSON API and write paths on a synthetic
+catalog, and write a JSON report that later runs can be compared with.
+
+    # SQLite and a local PostgreSQL database (all its tables are dropped)
+    python -m benchmarks.suite --items 10000 \
+        --database sqlite --database postgresql://localhost/catalog_bench \
+        --output baseline.json
+
+    # Fail when a scenario got more than 10% slower than the baseline
+    python -m benchmarks.suite --items 10000 --baseline baseline.json
+
+Requests go through the Flask test client with the rendered page cache
+disabled unless --cache is given, so rendering itself is measured.
+"""
+import datetime
+import json
+import platform
+import random
+import subprocess
+import sys
+
+import click
+from flask import url_for
+from sqlalchemy.engine.url import make_url
+
+from app.blueprints.catalog.models import Category, Item
+from app.extensions import fragment_cache
+from benchmarks.util import make_app, remove_database, fake_records, login, time_calls, summarize
+
+BENCH_USER = 'bench@catalogapp.com'
+
+READ_SCENARIOS = ('home', 'category', 'item', 'catalog_as_json', 'catalog_as_json_v2')
+WRITE_SCENARIOS = ('add_item', 'edit_item')
+SCENARIOS = READ_SCENARIOS + WRITE_SCENARIOS
+
+# Distinct pages requested in turn by the category and item scenarios.
+SAMPLE_SIZE = 100
+
+
+def _expect(status, response):
+    if response.status_code != status:
+        raise RuntimeError(f"Expected a {status} response, got {response.status_code}")
+    return response
+
+
+def _scenarios(app, client, seed):
+    """
+    Map every scenario name to a function issuing its index-th request.
+    """
+    rng = random.Random(seed)
+    with app.app_context():
+        categories = [(category.id, category.name) for category in Category.query.order_by(Category.id)]
+        items = [(item.name, item.category.name, item.category_id) for item in
+                 Item.query.filter_by(created_by=BENCH_USER).order_by(Item.id).limit(SAMPLE_SIZE * 10)]
+
+    with app.test_request_context():
+        category_urls = [url_for('catalog.home', category=name) for _, name in categories]
+        sample = rng.sample(items, min(SAMPLE_SIZE, len(items)))
+        item_urls = [url_for('catalog.item_in_category', category=category, item=item)
+                     for item, category, _ in sample]
+        edit_urls = [(url_for('catalog.edit_item', category=category, item=item), item, category_id)
+                     for item, category, category_id in sample]
+        add_url = url_for('catalog.add_item')
+
+    def add_item(index):
+        category_id = categories[index % len(categories)][0]
+        return _expect(302, client.post(add_url, data={'name': f'Benchmark item {index}',
+                                                       'description': f'Added by request {index}',
+                                                       'category_id': category_id}))
+
+    def edit_item(index):
+        # Items keep their name and category so the urls stay valid.
+        url, name, category_id = edit_urls[index % len(edit_urls)]
+        return _expect(302, client.post(url, data={'name': name,
+                                                   'description': f'Edited by request {index}',
+                                                   'category_id': category_id}))
+
+    return {
+        'home': lambda index: client.get('/'),
+        'category': lambda index: client.get(category_urls[index % len(category_urls)]),
+        'item': lambda index: client.get(item_urls[index % len(item_urls)]),
+        'catalog_as_json': lambda index: client.get('/api/v1/catalog'),
+        'catalog_as_json_v2': lambda index: client.get('/api/v2/catalog'),
+        'add_item': add_item,
+        'edit_item': edit_item
+    }
+
+
+def run_database(database, categories, items, requests, selected, seed, cache):
+    """
+    Seed a fresh database and time every selected scenario on it.
+
+    :return: dict of scenario name to summary
+    """
+    settings = {'WTF_CSRF_ENABLED': False}
+    if not cache:
+        settings['FRAGMENT_CACHE_BACKEND'] = 'null'
+    records = fake_records(categories, items, seed=seed, created_by=BENCH_USER)
+    app = make_app('production', None if database == 'sqlite' else database, records=records, **settings)
+
+    results = {}
+    try:
+        client = app.test_client()
+        login(app, client, BENCH_USER)
+        if cache:
+            with app.app_context():
+                fragment_cache.clear()
+        calls = _scenarios(app, client, seed)
+        for name in SCENARIOS:
+            if name not in selected:
+                continue
+            if name in READ_SCENARIOS:
+                # Warm up compiled templates and connections.
+                time_calls(calls[name], 5)
+            results[name] = summarize(time_calls(calls[name], requests))
+            print(f"  {name:<20} {results[name]['requests_per_sec']:>9.1f} req/s "
+                  f"p50 {results[name]['p50_ms']:>8.2f} ms  p99 {results[name]['p99_ms']:>8.2f} ms")
+    finally:
+        remove_database(app)
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, tolerance):
+    """
+    List the scenarios slower than in the baseline by more than tolerance,
+    on throughput or p99 latency.
+
+    :return: list of messages
+    """
+    regressions = []
+    for database, scenarios in report['results'].items():
+        for name, result in scenarios.items():
+            previous = baseline['results'].get(database, {}).get(name)
+            if previous is None:
+                continue
+            if result['requests_per_sec'] < previous['requests_per_sec'] * (1 - tolerance):
+                regressions.append(f"{database} {name}: {previous['requests_per_sec']:.1f} -> "
+                                   f"{result['requests_per_sec']:.1f} req/s")
+            if result['p99_ms'] > previous['p99_ms'] * (1 + tolerance):
+                regressions.append(f"{database} {name}: p99 {previous['p99_ms']:.2f} -> {result['p99_ms']:.2f} ms")
+    return regressions
+
+
+@click.command()
+@click.option('--database', 'databases', multiple=True, default=['sqlite'],
+              help="'sqlite' for a temporary file or a database uri, repeatable")
+@click.option('--categories', default=20, help='Categories in the synthetic catalog')
+@click.option('--items', default=10000, help='Items in the synthetic catalog')
+@click.option('--requests', default=200, help='Requests per scenario')
+@click.option('--scenario', 'selected', multiple=True, type=click.Choice(SCENARIOS),
+              help='Scenarios to run, repeatable, all by default')
+@click.option('--seed', default=0, help='Seed of the synthetic catalog')
+@click.option('--cache/--no-cache', default=False, help='Keep the rendered page cache enabled')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the JSON report to this file')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Report to compare with')
+@click.option('--tolerance', default=0.1, help='Slowdown allowed against the baseline, 0.1 is 10%')
+def suite(databases, categories, items, requests, selected, seed, cache, output, baseline, tolerance):
+    """
+    Time every scenario on each database and report throughput and latency.
+    """
+    selected = selected or SCENARIOS
+    report = {
+        'created': datetime.datetime.utcnow().isoformat(),
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'categories': categories, 'items': items, 'requests': requests, 'seed': seed,
+                     'cache': cache},
+        'results': {}
+    }
+
+    for database in databases:
+        # Never write passwords to the report.
+        label = database if database == 'sqlite' else repr(make_url(database))
+        print(label)
+        report['results'][label] = run_database(database, categories, items, requests, selected, seed, cache)
+
+    if output:
+        with open(output, 'w') as report_file:
+            json.dump(report, report_file, indent=2, sort_keys=True)
+
+    if baseline:
+        with open(baseline) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    suite()
@@ -0,0 +1,162 @@
+import math
+import os
+import tempfile
+import time
+
+from faker import Faker
+
+from app.app import create_app
+from app.blueprints.catalog.importer import CatalogImporter, iter_records
+from app.blueprints.user.models import User
+from app.extensions import db
+
+CATALOG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'catalog.json')
+
+
+def fake_records(categories, items, seed=0, created_by=None):
+    """
+    Yield a synthetic catalog as importer records: categories, then items
+    spread evenly over them. The same seed always yields the same catalog.
+
+    :param categories: Number of categories
+    :param items: Number of items
+    :param seed: Faker seed
+    :param created_by: Owner of the items
+    """
+    fake = Faker()
+    fake.seed(seed)
+
+    names = [f'{fake.word().title()} {index}' for index in range(categories)]
+    for name in names:
+        yield 'category', {'name': name, 'description': fake.sentence()}
+
+    for index in range(items):
+        yield 'item', {
+            'name': f'{fake.word().title()} {fake.word()} {index}',
+            'description': fake.paragraph(),
+            'category': names[index % categories],
+            'created_on': fake.date_time_between(start_date='-2y'),
+            'updated_on': fake.date_time_between(start_date='-1y'),
+            'created_by': created_by
+        }
+
+
+def make_app(env='development', database_uri=None, records=None, **settings):
+    """
+    Create an app on a fresh database seeded with catalog.json, or with
+    records such as those of fake_records. Without a database_uri a
+    temporary SQLite file is used; remove_database() deletes it.
+
+    Every table of the database is dropped first.
+
+    :param env: Configuration profile
+    :param database_uri: SQLAlchemy database uri
+    :param records: Importer records to seed instead of catalog.json
+    :param settings: Extra settings overrides
+    :return: Flask app
+    """
+    if database_uri is None:
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        database_uri = f'sqlite:///{path}'
+
+    overrides = {
+        'SQLALCHEMY_DATABASE_URI': database_uri,
+        'OAUTH_CONFIG': {},
+        'IMAGE_WORKERS': 0
+    }
+    overrides.update(settings)
+    app = create_app(overrides, env=env)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        with db.engine.connect() as connection:
+            if records is not None:
+                CatalogImporter(connection, batch_size=5000).run(records)
+            else:
+                with open(CATALOG_FILE, encoding='utf-8') as stream:
+                    CatalogImporter(connection).run(iter_records(stream, 'json'))
+    return app
+
+
+def remove_database(app):
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if uri.startswith('sqlite:///'):
+        path = uri[len('sqlite:///'):]
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def login(app, client, username):
+    """
+    Log a test client in as a user, created if needed.
+
+    :return: User id
+    """
+    with app.app_context():
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            user = User(username=username)
+            user.save()
+        user_id = user.id
+
+    with client.session_transaction() as session:
+        session['user_id'] = str(user_id)
+        session['_fresh'] = True
+    return user_id
+
+
+def time_calls(request, requests):
+    """
+    Time a request function called with 0 to requests - 1. It returns a
+    response whose body is read before the clock stops.
+
+    :return: list of latencies in seconds
+    """
+    latencies = []
+    for index in range(requests):
+        started = time.perf_counter()
+        response = request(index)
+        response.get_data()
+        latencies.append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{response.status_code} response on request {index}")
+    return latencies
+
+
+def time_requests(client, url, requests, **kwargs):
+    """
+    Issue the same GET request repeatedly through a test client.
+
+    :return: list of latencies in seconds
+    """
+    return time_calls(lambda index: client.get(url, **kwargs), requests)
+
+
+def percentile(latencies, rank):
+    """
+    Nearest rank percentile.
+
+    :param latencies: Non empty list of numbers
+    :param rank: Percentile between 0 and 100
+    """
+    ordered = sorted(latencies)
+    return ordered[max(0, math.ceil(rank / 100 * len(ordered)) - 1)]
+
+
+def summarize(latencies):
+    """
+    Throughput and latency statistics of a run, latencies in milliseconds.
+
+    :return: dict
+    """
+    total = sum(latencies)
+    return {
+        'requests': len(latencies),
+        'requests_per_sec': len(latencies) / total if total else 0.0,
+        'mean_ms': total / len(latencies) * 1000,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': max(latencies) * 1000
+    }
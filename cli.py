@@ -1,13 +1,22 @@
 import click
 
+from sqlalchemy import inspect
 from sqlalchemy_utils import database_exists, create_database
 
 from app.app import create_app
-from app.blueprints.catalog.models import Category, Item
+from app.blueprints.catalog.changes import install_triggers, prune_changes
+from app.blueprints.catalog.exporter import export_rows, iter_gzip, FORMATTERS
+from app.blueprints.catalog.importer import CatalogImporter, iter_records, parse_date
+from app.blueprints.catalog.models import Category, Item, category_cache, refresh_catalog_stats, \
+    refresh_recent_items
+from app.blueprints.catalog.search import rebuild_index
 from app.blueprints.user.models import User
-from app.extensions import db
+from app.extensions import db, fragment_cache, upload_store
+from app.mixins.sqlalchemy_resource_mixin import repair_timestamps
+from app.lib import assets as assets_pipeline
 import json
 import datetime
+import os
 
 # Create an app context for the database connection.
 app = create_app()
@@ -61,6 +70,252 @@ def seed_data():
     _seed_catalog()
 
 
+@click.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['json', 'jsonl', 'csv']),
+              help='File format, guessed from the extension by default')
+@click.option('--batch-size', default=1000, help='Items written per transaction')
+@click.option('--created-by', default='admin@catalogapp.com', help='Owner of items without created_by')
+def import_catalog(path, file_format, batch_size, created_by):
+    """
+    Stream a catalog file into the database, inserting new items and updating
+    existing ones matched by name and category. Nothing is deleted.
+
+    :param path: Catalog file (json, jsonl or csv)
+    :param file_format: Format of the file
+    :param batch_size: Items written per transaction
+    :param created_by: Owner of items without created_by
+    :return: None
+    """
+    if file_format is None:
+        file_format = os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in ('json', 'jsonl', 'csv'):
+            raise click.BadParameter(f"Can't guess the format of {path}, use --format")
+
+    def progress(importer):
+        print(f"{importer.items} items ({importer.rate:.0f} rows/sec)")
+
+    with app.app_context(), open(path, newline='', encoding='utf-8') as stream:
+        with db.engine.connect() as connection:
+            importer = CatalogImporter(connection, batch_size=batch_size, created_by=created_by, progress=progress)
+            importer.run(iter_records(stream, file_format))
+
+        category_cache.invalidate()
+        fragment_cache.clear()
+
+    print(f"Imported {importer.items} items in {len(importer.categories)} categories "
+          f"({importer.rate:.0f} rows/sec)")
+    return None
+
+
+@click.command('export')
+@click.option('--output', '-o', default='-', help='Output file, stdout by default')
+@click.option('--format', 'file_format', type=click.Choice(['jsonl', 'csv']), default='jsonl',
+              help='Output format')
+@click.option('--gzip/--no-gzip', 'compress', default=False, help='Gzip the output')
+@click.option('--category', multiple=True, help='Only export this category (repeatable)')
+@click.option('--updated-since', help='Only items updated at or after this time (ISO 8601)')
+@click.option('--updated-until', help='Only items updated before this time (ISO 8601)')
+def export_catalog(output, file_format, compress, category, updated_since, updated_until):
+    """
+    Stream the items of the catalog to a file in a format the import command
+    reads back. Memory use does not grow with the size of the catalog.
+
+    :return: None
+    """
+    with app.app_context():
+        formatter = FORMATTERS[file_format][0]
+        chunks = formatter(export_rows(list(category), parse_date(updated_since), parse_date(updated_until)))
+
+        with click.open_file(output, 'wb') as stream:
+            if compress:
+                for data in iter_gzip(chunks):
+                    stream.write(data)
+            else:
+                for chunk in chunks:
+                    stream.write(chunk.encode('utf-8'))
+    return None
+
+
+@click.command()
+def create_indexes():
+    """
+    Create the indexes declared on the models that are missing from an
+    existing database, e.g. the lower(name) indexes behind the case
+    insensitive item and category lookups. New databases get them from init.
+
+    :return: None
+    """
+    with app.app_context():
+        existing = _existing_index_names()
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name not in existing:
+                    print(f"Creating index {index.name} on {table.name}")
+                    index.create(db.engine)
+    return None
+
+
+@click.command()
+@click.option('--clean', is_flag=True, help='Only delete previously built files')
+def build_assets(clean):
+    """
+    Write fingerprinted and precompressed copies of the static files and the
+    bundles in ASSET_BUNDLES, along with the manifest mapping them. Restart
+    the app afterwards to pick up the new manifest.
+
+    :param clean: Only delete previously built files
+    :return: None
+    """
+    if clean:
+        assets_pipeline.clean(app.static_folder)
+        return None
+
+    manifest = assets_pipeline.build(app.static_folder, app.config['ASSET_BUNDLES'])
+    print(f"Built {len(manifest['files'])} files into {app.static_folder}")
+    return None
+
+
+@click.command()
+def create_columns():
+    """
+    Create the tables and add the columns declared on the models that are
+    missing from an existing database. New columns are nullable and left
+    empty unless they have a server default.
+
+    :return: None
+    """
+    with app.app_context():
+        db.create_all()
+        inspector = inspect(db.engine)
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    default = ''
+                    if column.server_default is not None:
+                        arg = column.server_default.arg
+                        if not isinstance(arg, str):
+                            arg = arg.compile(dialect=db.engine.dialect)
+                        default = f' DEFAULT {arg}'
+                    print(f"Adding column {column.name} to {table.name}")
+                    db.engine.execute(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}')
+    return None
+
+
+@click.command()
+def refresh_stats():
+    """
+    Recount the items of every category and rebuild the recent items list,
+    e.g. after adding the columns or writing to the database directly.
+
+    :return: None
+    """
+    with app.app_context():
+        refresh_catalog_stats(db.session)
+        db.session.commit()
+        category_cache.invalidate()
+        fragment_cache.clear()
+    print("Refreshed item counts and recent items")
+    return None
+
+
+@click.command('repair_timestamps')
+@click.option('--batch-size', default=1000, help='Rows updated per transaction')
+def repair_resource_timestamps(batch_size):
+    """
+    Fix missing, future and inconsistent created_on and updated_on values of
+    users, categories and items, then rebuild the recent items list.
+
+    :param batch_size: Rows updated per transaction
+    :return: None
+    """
+    with app.app_context():
+        for model in (User, Category, Item):
+            repaired = repair_timestamps(model, batch_size)
+            print(f"Repaired {repaired} {model.__tablename__} rows")
+        refresh_recent_items(db.session)
+        db.session.commit()
+        category_cache.invalidate()
+        fragment_cache.clear()
+    return None
+
+
+@click.command()
+@click.option('--dry-run', is_flag=True, help='Only list the files that would be deleted')
+def gc_uploads(dry_run):
+    """
+    Delete uploaded images, and their variants, that no item refers to any
+    more, and the temporary files of uploads, once older than
+    UPLOAD_STALE_SECONDS. Images are never deleted while items are saved:
+    an identical upload may be about to refer to the file again.
+
+    :param dry_run: Only list the files
+    :return: None
+    """
+    with app.app_context():
+        for path in list(upload_store.iter_stale_uploads(app.config['UPLOAD_STALE_SECONDS'])):
+            print(f"Deleting {path}")
+            if not dry_run:
+                os.remove(path)
+        referenced = {image[len('/uploads/'):] for image, in Item.query.with_entities(Item.image).distinct()
+                      .filter(Item.image.like('/uploads/%'))}
+        deleted = 0
+        for key in upload_store.iter_orphans(referenced, app.config['UPLOAD_STALE_SECONDS']):
+            print(f"Deleting {key}")
+            if not dry_run:
+                upload_store.delete(key)
+            deleted += 1
+    print(f"{deleted} orphaned uploads")
+    return None
+
+
+@click.command()
+def search_index():
+    """
+    Create the full text search index of an existing database if needed and
+    rebuild it from the item table.
+
+    :return: None
+    """
+    with app.app_context():
+        rebuild_index()
+    print("Search index rebuilt")
+    return None
+
+
+@click.command()
+def change_log():
+    """
+    Create the change log and the triggers filling it in an existing
+    database if needed.
+
+    :return: None
+    """
+    with app.app_context():
+        install_triggers()
+    print("Change log triggers installed")
+    return None
+
+
+@click.command('prune_changes')
+@click.option('--days', type=int, help='Keep the changes of the last days, CHANGE_LOG_RETENTION_DAYS by default')
+def prune_change_log(days):
+    """
+    Delete the old entries of the change log. Clients following the feed
+    from before the cutoff have to download the catalog again.
+
+    :param days: Days of changes kept
+    :return: None
+    """
+    with app.app_context():
+        days = days if days is not None else app.config['CHANGE_LOG_RETENTION_DAYS']
+        deleted = prune_changes(datetime.datetime.utcnow() - datetime.timedelta(days=days))
+    print(f"Deleted {deleted} changes")
+    return None
+
+
 # noinspection PyTypeChecker
 def _seed_catalog():
     with open('catalog.json') as catalog_file:
@@ -93,6 +348,26 @@ def _seed_catalog():
     _bulk_save_objects(Category, categories)
     _bulk_save_objects(Item, items)
 
+    # Bulk saves bypass the session events maintaining the catalog stats.
+    with app.app_context():
+        refresh_catalog_stats(db.session)
+        db.session.commit()
+
+
+def _existing_index_names():
+    # The reflection API skips expression indexes on some databases, so ask
+    # the catalog directly where possible.
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        rows = db.engine.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        return {row[0] for row in rows}
+    if dialect == 'postgresql':
+        rows = db.engine.execute("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()")
+        return {row[0] for row in rows}
+
+    inspector = inspect(db.engine)
+    return {index['name'] for table in db.metadata.sorted_tables for index in inspector.get_indexes(table.name)}
+
 
 def _get_date(string):
     return datetime.datetime.strptime(string, "%a, %d %b %Y %H:%M:%S GMT")
@@ -108,6 +383,17 @@ def _bulk_save_objects(model, objects):
 
 cli.add_command(init)
 cli.add_command(seed_data)
+cli.add_command(import_catalog)
+cli.add_command(export_catalog)
+cli.add_command(build_assets)
+cli.add_command(create_columns)
+cli.add_command(create_indexes)
+cli.add_command(gc_uploads)
+cli.add_command(search_index)
+cli.add_command(refresh_stats)
+cli.add_command(repair_resource_timestamps)
+cli.add_command(change_log)
+cli.add_command(prune_change_log)
 
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,17 @@
+# Production profile, loaded over config/settings.py when CATALOG_ENV is set
+# to 'production'. Secrets still belong in instance/settings.py.
+
+DEBUG = False
+
+LOG_LEVEL = 'INFO'
+
+# Never allow OAuth over plain HTTP in production.
+OAUTHLIB_INSECURE_TRANSPORT = False
+
+# Templates don't change between deploys: skip the freshness check on every
+# render and keep their compiled bytecode across restarts.
+TEMPLATES_AUTO_RELOAD = False
+JINJA_BYTECODE_CACHE = True
+
+# Share rendered pages between the workers of a host.
+FRAGMENT_CACHE_BACKEND = 'sqlite'
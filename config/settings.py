@@ -1,4 +1,7 @@
-# Flask Debug flag.
+import datetime
+
+# Flask Debug flag. Development defaults, set CATALOG_ENV=production to load
+# the overrides in config/production.py.
 DEBUG = True
 
 # Default log level
@@ -11,10 +14,53 @@ SERVER_NAME = 'localhost:8000'
 # Should be overriden using instance properties
 SECRET_KEY = 'ASecretStringGoesHere!!'
 
+# Sessions expire after 15 minutes of inactivity. A session cookie is only
+# sent once something is stored in the session, e.g. on login.
+PERMANENT_SESSION_LIFETIME = datetime.timedelta(minutes=15)
+
+# Seconds a logged in user is cached per process instead of being loaded on
+# every request, 0 to disable. Saving or deleting a user in the same process
+# invalidates it immediately.
+USER_CACHE_TTL = 60
+
 # Database properties. Override in Instance config.
 SQLALCHEMY_DATABASE_URI = "sqlite:////tmp/database.db"
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of every database. The threaded server holds at most one
+# connection per busy thread: POOL_SIZE connections are kept open, up to
+# MAX_OVERFLOW more are opened under load and a request waits POOL_TIMEOUT
+# seconds for one before failing. Connections are replaced after
+# POOL_RECYCLE seconds and, except on SQLite, pinged before every use.
+# SQLite files are pooled too, set SQLALCHEMY_POOL_SIZE = 0 to open one
+# connection per request instead.
+SQLALCHEMY_POOL_SIZE = 10
+SQLALCHEMY_MAX_OVERFLOW = 10
+SQLALCHEMY_POOL_TIMEOUT = 10
+SQLALCHEMY_POOL_RECYCLE = 1800
+SQLALCHEMY_POOL_PRE_PING = True
+
+# Send the reads of the catalog pages and APIs to a replica: add it to
+# SQLALCHEMY_BINDS, e.g. {'replica': 'postgresql://replica/catalog'}, and
+# set DATABASE_REPLICA_BIND = 'replica'. Writes always go to
+# SQLALCHEMY_DATABASE_URI, and users read from it for REPLICA_STICKY_SECONDS
+# after their own writes so replication lag doesn't hide them.
+DATABASE_REPLICA_BIND = None
+REPLICA_STICKY_SECONDS = 10
+
+# PostgreSQL aborts statements running longer than this many milliseconds,
+# None for no limit.
+DATABASE_STATEMENT_TIMEOUT = 30000
+
+# Run on every new SQLite connection. WAL lets readers proceed while a write
+# is in progress and busy_timeout makes writers wait up to 5 seconds for the
+# lock instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000
+}
+
 # OAuth config for various providers. Override in instance properties
 OAUTH_CONFIG = {
     "GOOGLE": {
@@ -41,6 +87,110 @@ DEBUG_TB_INTERCEPT_REDIRECTS = False
 # pagination
 ITEMS_PER_PAGE = 6
 
+# Number of most recently updated items kept in the recent_item table. The
+# front page is served from it, without sorting the item table, as long as
+# the requested page falls within it.
+RECENT_ITEMS_SIZE = 60
+
+# The category list is cached per process. Writes through Category.save()/
+# delete() invalidate it immediately, writes of other processes are seen
+# within this many seconds, when the change log is checked again.
+CATEGORY_CACHE_CHECK_SECONDS = 5
+
+# Compiled template bytecode is kept on disk when JINJA_BYTECODE_CACHE is
+# enabled, in JINJA_BYTECODE_CACHE_DIR (defaults to jinja-cache in the
+# instance folder). The directory must be private to the app's user.
+JINJA_BYTECODE_CACHE = False
+JINJA_BYTECODE_CACHE_DIR = None
+
+# Rendered page cache: 'lru' keeps pages per process, 'sqlite' shares them
+# between the workers of a host through FRAGMENT_CACHE_SQLITE_PATH
+# (defaults to a file in the instance folder), 'null' disables caching.
+FRAGMENT_CACHE_BACKEND = 'lru'
+FRAGMENT_CACHE_MAX_ENTRIES = 500
+FRAGMENT_CACHE_TIMEOUT = 300
+FRAGMENT_CACHE_SQLITE_PATH = None
+
+# Uploaded images are resized on IMAGE_WORKERS background threads (0 resizes
+# inline) into one variant per entry of IMAGE_VARIANTS: (max width, height).
+IMAGE_WORKERS = 2
+IMAGE_VARIANTS = {
+    'thumbnail': (300, 200),
+    'web': (1200, 1200)
+}
+
+# Uploads are stored by content hash under UPLOAD_FOLDER (instance/uploads
+# when None) and served with a far future, immutable Cache-Control.
+UPLOAD_FOLDER = None
+UPLOAD_CACHE_MAX_AGE = 31536000
+
+# Uploads to UPLOAD_STREAMING_ENDPOINTS by logged in users are streamed
+# into UPLOAD_FOLDER while the request body is read.
+# Requests over MAX_CONTENT_LENGTH are refused from their Content-Length,
+# files over UPLOAD_MAX_SIZE or whose first bytes are not one of
+# UPLOAD_ALLOWED_TYPES are rejected as soon as that is known.
+MAX_CONTENT_LENGTH = 10 * 1024 * 1024
+UPLOAD_MAX_SIZE = 8 * 1024 * 1024
+UPLOAD_ALLOWED_TYPES = ('jpeg', 'png')
+UPLOAD_STREAMING_ENDPOINTS = ('catalog.upload_image',)
+# Uploads no item refers to, and temporary files of uploads left behind by
+# a killed worker, are deleted by python cli.py gc_uploads once older than
+# this many seconds. Schedule it, e.g. daily.
+UPLOAD_STALE_SECONDS = 3600
+
+# Static files. Run `python cli.py build_assets` to write fingerprinted,
+# precompressed copies and the manifest used to serve them with far future
+# caching. Pages include every bundle as one file once built.
+ASSET_MANIFEST = True
+ASSET_CACHE_MAX_AGE = 31536000
+ASSET_BUNDLES = {
+    'styles/bundle.css': [
+        'styles/vendor/bootstrap.min.css',
+        'styles/main.css',
+        'styles/vendor/font-awesome.min.css',
+        'styles/vendor/eonasdan-bootstrap-datetimepicker.4.13.30.min.css',
+        'styles/vendor/bootstrap-social.css'
+    ],
+    'scripts/bundle.js': [
+        'scripts/vendor/bootstrap.min.js',
+        'scripts/vendor/moment.min.js',
+        'scripts/vendor/eonasdan-bootstrap-datetimepicker.4.14.30.min.js',
+        'scripts/vendor/notify.min.js',
+        'scripts/main.js'
+    ]
+}
+
+# Raise instead of logging a warning when a view decorated with
+# @query_budget issues more SQL statements than allowed. Enable in tests.
+QUERY_BUDGET_STRICT = False
+
+# Page size of the streaming /api/v2/catalog endpoint. Clients may ask for
+# fewer or more items per page using ?limit= up to API_MAX_PAGE_SIZE.
+API_PAGE_SIZE = 500
+API_MAX_PAGE_SIZE = 5000
+
+# Port of the asyncio server of the read only API, run_async.py. It uses
+# the database settings above.
+ASYNC_API_PORT = 8001
+
+# Most operations accepted in one request to /api/v1/items/batch.
+API_BATCH_MAX_ITEMS = 1000
+
+# Change feed at /api/v1/changes. A waiting client holds a worker thread,
+# so keep CHANGES_MAX_WAIT and CHANGES_STREAM_TIMEOUT well below the
+# proxy's read timeout. python cli.py prune_changes deletes the changes
+# older than CHANGE_LOG_RETENTION_DAYS.
+CHANGES_POLL_INTERVAL = 1
+CHANGES_MAX_WAIT = 25
+CHANGES_STREAM_TIMEOUT = 300
+CHANGE_LOG_RETENTION_DAYS = 30
+
+# Per process request latency, SQL and template timings and cache hit
+# ratios in the Prometheus text format at METRICS_PATH. Nothing is measured
+# while disabled. Keep the endpoint private, e.g. at the proxy.
+METRICS_ENABLED = False
+METRICS_PATH = '/metrics'
+
 # Important properties to override in instance config:
 # SECRET_KEY
 # OAUTH_CONFIG
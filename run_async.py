@@ -0,0 +1,8 @@
+from aiohttp import web
+
+from app import app
+from app.blueprints.catalog.aio import create_async_app
+
+if __name__ == '__main__':
+    flask_app = app.create_app()
+    web.run_app(create_async_app(flask_app.config), host='0.0.0.0', port=flask_app.config['ASYNC_API_PORT'])
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from app.blueprints.catalog.models import Category, category_cache
+from app.blueprints.user.models import user_cache
+from benchmarks.util import make_app, remove_database, fake_records, login
+
+CATEGORIES = 3
+ITEMS = 30
+USERNAME = 'tester'
+
+
+@pytest.fixture
+def app():
+    """
+    App on a temporary SQLite database seeded with a synthetic catalog of
+    ITEMS items in CATEGORIES categories. Views going over their query
+    budget raise.
+    """
+    app = make_app(records=fake_records(CATEGORIES, ITEMS), TESTING=True, WTF_CSRF_ENABLED=False,
+                   FRAGMENT_CACHE_BACKEND='null', QUERY_BUDGET_STRICT=True)
+    # The process wide caches outlive the database of the previous test.
+    category_cache.invalidate()
+    user_cache.invalidate()
+    yield app
+    remove_database(app)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user_client(app, client):
+    """
+    Test client logged in as USERNAME.
+    """
+    login(app, client, USERNAME)
+    return client
+
+
+@pytest.fixture
+def category_names(app):
+    with app.app_context():
+        return [category.name for category in Category.query.order_by(Category.id)]
+
+
+
+def post_batch(client, operations):
+    """
+    Send operations to the batch API.
+
+    :return: tuple of (status code, response JSON)
+    """
+    response = client.post('/api/v1/items/batch', data=json.dumps({'items': operations}),
+                           content_type='application/json')
+    return response.status_code, json.loads(response.get_data(as_text=True))
@@ -0,0 +1,76 @@
+import asyncio
+import json
+from email.utils import parsedate
+
+import pytest
+from aiohttp import test_utils
+
+from app.blueprints.catalog import aio
+from app.blueprints.catalog.aio import create_async_app
+from app.lib.aio_database import AsyncDatabase
+
+
+@pytest.fixture
+def loop():
+    # aiosqlite binds its connections to the current event loop.
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def get_async(app, loop, url):
+    """
+    GET a url from the asyncio server.
+
+    :return: tuple of (status code, response JSON)
+    """
+    async def get():
+        client = test_utils.TestClient(test_utils.TestServer(create_async_app(app.config), loop=loop), loop=loop)
+        await client.start_server()
+        try:
+            response = await client.get(url)
+            return response.status, await response.json()
+        finally:
+            await client.close()
+
+    return loop.run_until_complete(get())
+
+
+def test_catalog_pages(app, client, loop, monkeypatch):
+    # Every category of the synthetic catalog spans several pages.
+    monkeypatch.setattr(aio, 'CATALOG_PAGE_SIZE', 4)
+    queries = []
+    fetch = AsyncDatabase.fetch
+
+    def counted_fetch(self, query):
+        # A keyset condition matching the last row again pages forever.
+        queries.append(query)
+        if len(queries) > 100:
+            raise RuntimeError("Catalog pages do not advance")
+        return fetch(self, query)
+
+    monkeypatch.setattr(AsyncDatabase, 'fetch', counted_fetch)
+    status, catalog = get_async(app, loop, '/api/v1/catalog')
+    assert status == 200
+
+    expected = json.loads(client.get('/api/v1/catalog').get_data(as_text=True))
+    assert sum(len(category['items']) for category in catalog['Categories']) == 30
+    assert len(catalog['Categories']) == len(expected['Categories'])
+    for category, expected_category in zip(catalog['Categories'], expected['Categories']):
+        # Same items, in the order of the keyset pages rather than the WSGI
+        # app's.
+        items = category.pop('items')
+        expected_items = expected_category.pop('items')
+        assert category == expected_category
+        assert sorted(items, key=lambda item: item['id']) == sorted(expected_items, key=lambda item: item['id'])
+        assert [item['id'] for item in items] == \
+            [item['id'] for item in sorted(items, key=lambda item: (parsedate(item['created_on']), item['id']))]
+
+
+def test_item(app, client, loop):
+    category = json.loads(client.get('/api/v1/catalog').get_data(as_text=True))['Categories'][0]
+    item = category['items'][0]
+    status, found = get_async(app, loop, f"/api/v1/catalog/{category['name'].upper()}/items/{item['name']}")
+    assert (status, found) == (200, item)
@@ -0,0 +1,63 @@
+import json
+from urllib.parse import quote
+
+import pytest
+
+from app.blueprints.catalog.models import Item
+from tests.conftest import ITEMS
+
+
+def read_pages(client, query):
+    """
+    Follow the cursors of the v2 catalog from its first page.
+
+    :return: list of item ids
+    """
+    seen = []
+    cursor = None
+    while True:
+        url = f'/api/v2/catalog?{query}&limit=7'
+        if cursor:
+            url += f'&cursor={cursor}'
+        page = json.loads(client.get(url).get_data(as_text=True))
+        seen.extend(item['id'] for item in page['items'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            return seen
+
+
+@pytest.mark.parametrize('order', ['id', 'name', 'created_on', 'updated_on', 'category'])
+@pytest.mark.parametrize('direction', ['asc', 'desc'])
+def test_v2_catalog_pages(app, client, order, direction):
+    with app.app_context():
+        expected = [item.id for item in Item.join_sort(Item.query, order)
+                    .order_by(*Item.order_by_clauses(order, direction))]
+
+    assert len(expected) == ITEMS
+    assert read_pages(client, f'order={order}&direction={direction}') == expected
+
+
+def test_v2_catalog_category_filter_ignores_case(client, category_names):
+    url = '/api/v2/catalog?category=' + quote(category_names[0].upper())
+    page = json.loads(client.get(url).get_data(as_text=True))
+    assert [category['name'] for category in page['categories']] == [category_names[0]]
+    assert page['items']
+
+
+def test_v2_catalog_bad_cursor(client):
+    assert client.get('/api/v2/catalog?cursor=garbage').status_code == 400
+    assert client.get('/api/v2/catalog?order=category_id').status_code == 400
+
+
+def test_v1_catalog(client, category_names):
+    catalog = json.loads(client.get('/api/v1/catalog').get_data(as_text=True))['Categories']
+    assert sorted(category['name'] for category in catalog) == sorted(category_names)
+    assert sum(len(category['items']) for category in catalog) == ITEMS
+
+
+def test_v2_catalog_sorted_by_category_name(app, client):
+    with app.app_context():
+        names = {item.id: item.category.name for item in Item.query}
+
+    seen = read_pages(client, 'order=category')
+    assert [names[item_id] for item_id in seen] == sorted(names[item_id] for item_id in seen)
@@ -0,0 +1,92 @@
+from app.blueprints.catalog.models import Item
+from app.extensions import db
+from tests.conftest import post_batch
+
+
+def create_items(client, category, *names):
+    status, body = post_batch(client, [{'op': 'create', 'name': name, 'description': 'Test', 'category': category}
+                                       for name in names])
+    assert status == 200, body
+    return [result['id'] for result in body['results']]
+
+
+def test_create_update_delete(app, user_client, category_names):
+    first, second = create_items(user_client, category_names[0], 'First', 'Second')
+
+    status, body = post_batch(user_client, [
+        {'op': 'update', 'id': first, 'name': 'Renamed', 'category': category_names[1].upper()},
+        {'op': 'delete', 'id': second}
+    ])
+    assert status == 200, body
+    assert [result['status'] for result in body['results']] == ['updated', 'deleted']
+
+    with app.app_context():
+        renamed = Item.query.get(first)
+        assert renamed.name == 'Renamed' and renamed.category.name == category_names[1]
+        assert Item.query.get(second) is None
+
+
+def test_invalid_batch_writes_nothing(app, user_client, category_names):
+    with app.app_context():
+        count = Item.query.count()
+
+    status, body = post_batch(user_client, [
+        {'op': 'create', 'name': 'Fine', 'description': 'Test', 'category': category_names[0]},
+        {'op': 'create', 'name': 'Lost', 'description': 'Test', 'category': 'No Such Category'},
+        {'op': 'create', 'name': 'Fine', 'description': 'Again', 'category': category_names[0]},
+        {'op': 'delete', 'id': 0},
+        {'op': 'rename'}
+    ])
+    assert status == 422
+    assert [result['status'] for result in body['results']] == \
+        ['not_applied', 'invalid', 'invalid', 'invalid', 'invalid']
+    with app.app_context():
+        assert Item.query.count() == count
+
+
+def test_only_owner_may_write(app, user_client):
+    with app.app_context():
+        # The seeded items belong to nobody.
+        item_id = Item.query.first().id
+
+    status, body = post_batch(user_client, [{'op': 'delete', 'id': item_id}])
+    assert status == 422
+    assert body['results'][0]['errors'] == ['not authorized']
+
+
+def test_swapped_names_are_rejected(user_client, category_names):
+    first, second = create_items(user_client, category_names[0], 'First', 'Second')
+
+    status, body = post_batch(user_client, [
+        {'op': 'update', 'id': first, 'name': 'Second'},
+        {'op': 'update', 'id': second, 'name': 'First'}
+    ])
+    assert status == 422
+    assert all('separate batch' in result['errors'][0] for result in body['results'])
+
+
+def test_names_freed_in_the_batch(user_client, category_names):
+    first, second = create_items(user_client, category_names[0], 'First', 'Second')
+
+    status, body = post_batch(user_client, [
+        {'op': 'delete', 'id': first},
+        {'op': 'update', 'id': second, 'name': 'First'},
+        {'op': 'create', 'name': 'Second', 'description': 'Test', 'category': category_names[0]}
+    ])
+    assert status == 200, body
+
+
+def test_new_image_clears_variants(app, user_client, category_names):
+    item_id, = create_items(user_client, category_names[0], 'Pictured')
+    with app.app_context():
+        item = Item.query.get(item_id)
+        item.thumbnail = '/uploads/thumbnail.jpg'
+        item.web_image = '/uploads/web.jpg'
+        db.session.commit()
+
+    status, body = post_batch(user_client, [{'op': 'update', 'id': item_id, 'image': 'http://example.com/new.jpg'}])
+    assert status == 200, body
+    with app.app_context():
+        item = Item.query.get(item_id)
+        assert item.image == 'http://example.com/new.jpg'
+        assert item.thumbnail is None and item.web_image is None
@@ -0,0 +1,43 @@
+import time
+
+from sqlalchemy import text
+
+from app.blueprints.catalog.models import Category
+from app.extensions import db
+from app.lib.util_sqlalchemy import QueryCounter
+
+
+def test_hits_do_not_query(app):
+    with app.app_context():
+        names = [category.name for category in Category.get_cached_categories()]
+    with app.app_context(), QueryCounter() as counter:
+        assert [category.name for category in Category.get_cached_categories()] == names
+    assert counter.count == 0
+
+
+def test_writes_of_other_processes(app, monkeypatch):
+    with app.app_context():
+        Category.get_cached_categories()
+        # Another process renames a category, without invalidating this
+        # process' cache.
+        db.session.execute(text("UPDATE category SET name = 'Renamed' WHERE id = 1"))
+        db.session.commit()
+
+    with app.app_context():
+        assert 'Renamed' not in Category.get_categories_as_list()
+
+    later = time.time() + app.config['CATEGORY_CACHE_CHECK_SECONDS']
+    monkeypatch.setattr(time, 'time', lambda: later)
+    with app.app_context():
+        assert 'Renamed' in Category.get_categories_as_list()
+
+
+def test_local_writes_invalidate(app):
+    with app.app_context():
+        Category.get_cached_categories()
+        category = Category.query.get(1)
+        category.name = 'Renamed'
+        category.save()
+
+    with app.app_context():
+        assert 'Renamed' in Category.get_categories_as_list()
@@ -0,0 +1,74 @@
+import datetime
+import json
+
+from sqlalchemy import text
+
+from app.blueprints.catalog.changes import install_triggers, prune_changes
+from app.blueprints.catalog.models import Category, Item, Change
+from app.extensions import db
+from tests.conftest import post_batch
+
+
+def get_changes(client, cursor=None):
+    url = '/api/v1/changes' + (f'?since={cursor}' if cursor else '')
+    response = client.get(url)
+    assert response.status_code == 200
+    return json.loads(response.get_data(as_text=True))
+
+
+def test_feed_starts_at_the_latest_change(client):
+    start = get_changes(client)
+    assert start['changes'] == []
+    assert get_changes(client, start['next_cursor']) == start
+
+
+def test_item_changes(app, user_client, category_names):
+    cursor = get_changes(user_client)['next_cursor']
+
+    status, body = post_batch(user_client, [
+        {'op': 'create', 'name': 'Followed', 'description': 'Test', 'category': category_names[0]}])
+    assert status == 200, body
+    item_id = body['results'][0]['id']
+    post_batch(user_client, [{'op': 'delete', 'id': item_id}])
+
+    feed = get_changes(user_client, cursor)
+    # The maintained item counts of the category are not published.
+    assert [(change['entity'], change['id'], change['operation']) for change in feed['changes']] == \
+        [('item', item_id, 'insert'), ('item', item_id, 'delete')]
+    # The current state: the item is gone.
+    assert feed['changes'][0]['data'] is None
+    assert get_changes(user_client, feed['next_cursor'])['changes'] == []
+
+
+def test_category_changes(app, client):
+    cursor = get_changes(client)['next_cursor']
+    with app.app_context():
+        category = Category.query.first()
+        category.description = 'Changed'
+        db.session.commit()
+        category_id = category.id
+        item = Item.query.first()
+        item.description = 'Changed'
+        db.session.commit()
+        item_id = item.id
+
+    changes = get_changes(client, cursor)['changes']
+    assert [(change['entity'], change['id'], change['operation']) for change in changes] == \
+        [('category', category_id, 'update'), ('item', item_id, 'update')]
+    assert changes[0]['data']['description'] == 'Changed'
+
+
+def test_bad_cursor(client):
+    assert client.get('/api/v1/changes?since=garbage').status_code == 400
+
+
+def test_changed_on_format(app, client):
+    with app.app_context():
+        Item.query.first().delete()
+        stored = db.session.execute(text('SELECT changed_on FROM change_log ORDER BY id DESC')).scalar()
+        # Like every other date: microseconds included.
+        assert len(stored) == len('2017-01-20 05:23:01.000000')
+
+        install_triggers()
+        assert prune_changes(datetime.datetime.utcnow() + datetime.timedelta(seconds=1)) > 0
+        assert Change.query.count() == 1
@@ -0,0 +1,48 @@
+from sqlalchemy import text
+
+from app.blueprints.catalog.models import Item
+from app.extensions import db
+
+
+def test_etag(app, client):
+    response = client.get('/')
+    etag = response.headers['ETag'].strip('"')
+    assert response.status_code == 200
+
+    response = client.get('/', headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+    assert not response.get_data()
+
+    with app.app_context():
+        item = Item.query.first()
+        item.description = 'Changed'
+        item.save()
+
+    response = client.get('/', headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 200
+    assert response.headers['ETag'].strip('"') != etag
+
+
+def test_etag_depends_on_user(app, user_client):
+    anonymous = app.test_client().get('/').headers['ETag']
+    assert user_client.get('/').headers['ETag'] != anonymous
+
+
+def test_last_modified_moves_with_deletes(app, client):
+    with app.app_context():
+        # The catalog was last written long ago. The change log goes last:
+        # the updates are logged.
+        for table, column in (('category', 'updated_on'), ('item', 'updated_on'), ('change_log', 'changed_on')):
+            db.session.execute(text(f"UPDATE {table} SET {column} = '2000-01-01 00:00:00.000000'"))
+        db.session.commit()
+
+    last_modified = client.get('/').headers['Last-Modified']
+    response = client.get('/', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+
+    with app.app_context():
+        Item.query.order_by(Item.updated_on.desc()).first().delete()
+
+    response = client.get('/', headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 200
+    assert response.headers['Last-Modified'] != last_modified
@@ -0,0 +1,56 @@
+import os
+import tempfile
+
+import pytest
+from flask import g
+
+from app.blueprints.catalog.models import Category, category_cache
+from app.blueprints.user.models import User, user_cache
+from app.extensions import db
+from benchmarks.util import make_app, remove_database, fake_records
+
+
+@pytest.fixture
+def replicated_app():
+    """
+    App whose replica is a second SQLite file with the same tables and no
+    rows, as a replica lagging behind every write would be.
+    """
+    handle, replica_path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    app = make_app(records=fake_records(3, 6), TESTING=True,
+                   SQLALCHEMY_BINDS={'replica': f'sqlite:///{replica_path}'}, DATABASE_REPLICA_BIND='replica')
+    with app.app_context():
+        db.Model.metadata.create_all(db.get_engine(app, bind='replica'))
+        User(username='replicated').save()
+
+    category_cache.invalidate()
+    user_cache.invalidate()
+    yield app
+    category_cache.invalidate()
+    user_cache.invalidate()
+    remove_database(app)
+    os.remove(replica_path)
+
+
+def test_use_replica_reads_from_replica(replicated_app):
+    with replicated_app.test_request_context('/'):
+        assert Category.query.count() == 3
+        g.use_replica = True
+        assert Category.query.count() == 0
+
+
+def test_category_cache_fills_from_primary(replicated_app):
+    with replicated_app.test_request_context('/'):
+        g.use_replica = True
+        assert len(Category.get_cached_categories()) == 3
+        # Reads after the fill still go to the replica.
+        assert Category.query.count() == 0
+
+
+def test_user_cache_fills_from_primary(replicated_app):
+    with replicated_app.test_request_context('/'):
+        user_id = User.query.filter_by(username='replicated').one().id
+        g.use_replica = True
+        user = user_cache.get(user_id)
+        assert user is not None and user.username == 'replicated'
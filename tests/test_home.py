@@ -0,0 +1,25 @@
+from urllib.parse import quote
+
+from app.blueprints.catalog.views import home
+from app.lib.util_sqlalchemy import QueryCounter
+
+
+def test_home_query_budget(client, category_names):
+    category = quote(category_names[0])
+    counts = {}
+    for path in ('/', '/catalog/items/2', '/?sort=category&direction=desc', '/?sort=name',
+                 f'/catalog/{category}/items', f'/catalog/{category}/items/2'):
+        with QueryCounter() as counter:
+            response = client.get(path)
+        assert response.status_code == 200, path
+        counts[path] = counter.count
+
+    # The view raises over its budget; @conditional reads the validators.
+    assert max(counts.values()) <= home.query_budget + 1
+    # Filtered and deeper pages cost the same as the first one.
+    assert len(set(counts.values())) == 1, counts
+
+
+def test_home_unknown_category(client):
+    assert client.get('/catalog/No%20Such%20Category/items').status_code == 404
+
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+from PIL import Image
+
+from app.lib.images import make_variants
+
+SIZES = {'thumbnail': (30, 20)}
+
+
+@pytest.fixture
+def original(tmpdir):
+    path = str(tmpdir.join('original.png'))
+    Image.new('RGB', (300, 100), 'red').save(path)
+    return path
+
+
+def test_variants(original):
+    assert make_variants(original, SIZES) == {'thumbnail': 'original_thumbnail.png'}
+    with Image.open(original.replace('.png', '_thumbnail.png')) as thumbnail:
+        assert thumbnail.size == (30, 10)
+    assert sorted(os.listdir(os.path.dirname(original))) == ['original.png', 'original_thumbnail.png']
+
+
+def test_truncated_variant_is_written_again(original):
+    target = original.replace('.png', '_thumbnail.png')
+    with open(original, 'rb') as source, open(target, 'wb') as truncated:
+        truncated.write(source.read()[:40])
+
+    make_variants(original, SIZES)
+    with Image.open(target) as thumbnail:
+        thumbnail.load()
+        assert thumbnail.size == (30, 10)
+
+
+def test_failed_write_leaves_nothing(original, monkeypatch):
+    def fail(*args, **kwargs):
+        raise IOError('disk full')
+
+    monkeypatch.setattr(Image.Image, 'save', fail)
+    with pytest.raises(IOError):
+        make_variants(original, SIZES)
+    assert os.listdir(os.path.dirname(original)) == ['original.png']
@@ -0,0 +1,28 @@
+import datetime
+
+import pytest
+
+from app.lib.util_pagination import encode_cursor, decode_cursor, InvalidCursor
+
+
+def test_cursor_round_trip():
+    values = (datetime.datetime(2017, 1, 20, 5, 23, 1, 123456), 'Soccer Ball', 42)
+    cursor = encode_cursor(*values)
+    assert '=' not in cursor
+    assert decode_cursor(cursor, datetime.datetime, str, int) == values
+
+
+@pytest.mark.parametrize('cursor', ['', 'not a cursor', encode_cursor(1)[:-2] + '!!'])
+def test_cursor_garbage(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, int)
+
+
+def test_cursor_wrong_arity():
+    with pytest.raises(InvalidCursor):
+        decode_cursor(encode_cursor(1, 2), int)
+
+
+def test_cursor_wrong_type():
+    with pytest.raises(InvalidCursor):
+        decode_cursor(encode_cursor('yesterday', 2), datetime.datetime, int)
@@ -0,0 +1,139 @@
+import io
+import os
+import time
+
+import pytest
+from PIL import Image
+
+from app.blueprints.catalog.models import Item, category_cache
+from app.blueprints.user.models import user_cache
+from app.extensions import upload_store
+from app.lib.storage import UPLOAD_PREFIX
+from benchmarks.util import make_app, remove_database, fake_records
+from tests.conftest import CATEGORIES, ITEMS, USERNAME
+
+
+@pytest.fixture
+def app(tmpdir):
+    """
+    App whose uploads are stored in a temporary directory.
+    """
+    app = make_app(records=fake_records(CATEGORIES, ITEMS, created_by=USERNAME), TESTING=True,
+                   WTF_CSRF_ENABLED=False, FRAGMENT_CACHE_BACKEND='null', UPLOAD_FOLDER=str(tmpdir))
+    category_cache.invalidate()
+    user_cache.invalidate()
+    yield app
+    remove_database(app)
+
+
+@pytest.fixture
+def item(app):
+    with app.app_context():
+        item = Item.query.order_by(Item.id).first()
+        return item.id, f'/catalog/{item.category.name}/items/{item.name}/edit/upload'
+
+
+def png(size=(600, 400), color='red'):
+    stream = io.BytesIO()
+    Image.new('RGB', size, color).save(stream, 'PNG')
+    return stream.getvalue()
+
+
+def upload(client, url, data, filename='image.png'):
+    return client.post(url, data={'image': (io.BytesIO(data), filename)}, content_type='multipart/form-data')
+
+
+def get_item(app, item_id):
+    with app.app_context():
+        return Item.query.get(item_id)
+
+
+def test_variant_urls(app, user_client, item):
+    item_id, url = item
+    assert upload(user_client, url, png()).status_code == 302
+
+    uploaded = get_item(app, item_id)
+    for image_url in uploaded.image, uploaded.thumbnail, uploaded.web_image:
+        response = user_client.get(image_url)
+        assert response.status_code == 200
+        assert response.cache_control.max_age == app.config['UPLOAD_CACHE_MAX_AGE']
+    assert uploaded.thumbnail.startswith(uploaded.image.rsplit('/', 1)[0] + '/')
+    with Image.open(upload_store.path(uploaded.thumbnail[len('/uploads/'):])) as thumbnail:
+        assert thumbnail.size[0] <= app.config['IMAGE_VARIANTS']['thumbnail'][0]
+
+
+def test_orphans(app):
+    with app.app_context():
+        old, recent, referenced = (upload_store.put(io.BytesIO(png(color=color))) for color in ('red', 'green', 'blue'))
+    past = time.time() - 2 * app.config['UPLOAD_STALE_SECONDS']
+    for key in old, referenced:
+        os.utime(upload_store.path(key), (past, past))
+
+    orphans = list(upload_store.iter_orphans({referenced}, app.config['UPLOAD_STALE_SECONDS']))
+    assert orphans == [old]
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    """
+    Uploads streamed into the store.
+    """
+    opened = []
+    open_upload = upload_store.open_upload
+
+    def spy(*args, **kwargs):
+        opened.append(open_upload(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(upload_store, 'open_upload', spy)
+    return opened
+
+
+def stored_files(app):
+    return [os.path.join(directory, name)[len(app.config['UPLOAD_FOLDER']):]
+            for directory, _, files in os.walk(app.config['UPLOAD_FOLDER']) for name in files]
+
+
+def test_upload_is_streamed(app, user_client, item, opened):
+    item_id, url = item
+    data = png()
+    assert upload(user_client, url, data).status_code == 302
+    assert [pending.size for pending in opened] == [len(data)]
+    assert not any(os.path.basename(path).startswith(UPLOAD_PREFIX) for path in stored_files(app))
+
+
+def test_oversize_upload(app, user_client, item, opened):
+    item_id, url = item
+    app.config['UPLOAD_MAX_SIZE'] = 1024
+    assert upload(user_client, url, png(size=(1000, 1000)) + os.urandom(4096)).status_code == 413
+    # Rejected once the limit is crossed, not after reading the whole file.
+    assert opened[0].size <= 1024 + (1 << 16)
+    assert stored_files(app) == []
+    assert get_item(app, item_id).image is None
+
+
+def test_unsupported_upload(app, user_client, item, opened):
+    item_id, url = item
+    assert upload(user_client, url, b'GIF89a' + bytes(1024), filename='image.png').status_code == 415
+    assert len(opened) == 1
+    assert stored_files(app) == []
+    assert get_item(app, item_id).image is None
+
+
+def test_anonymous_upload_is_not_streamed(app, client, item, opened):
+    item_id, url = item
+    assert upload(client, url, png()).status_code == 302
+    assert opened == []
+    assert stored_files(app) == []
+
+
+def test_stale_uploads(app):
+    root = app.config['UPLOAD_FOLDER']
+    os.makedirs(os.path.join(root, 'ab', 'cd'))
+    stale, recent = (os.path.join(root, 'ab', 'cd', f'{UPLOAD_PREFIX}{name}') for name in ('stale', 'recent'))
+    for path in stale, recent:
+        open(path, 'wb').close()
+    past = time.time() - 2 * app.config['UPLOAD_STALE_SECONDS']
+    os.utime(stale, (past, past))
+
+    assert list(upload_store.iter_stale_uploads(app.config['UPLOAD_STALE_SECONDS'])) == [stale]